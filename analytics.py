@@ -1,70 +1,212 @@
+import io
+import logging
 import os
+import threading
+import time
+import uuid
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, Dict, Optional, Sequence
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
 
+# История сделок — Parquet-датасет с партициями по UTC-дню:
+#   logs/trades/date=YYYY-MM-DD/<uuid>.parquet
+TRADES_DIR = Path("logs/trades")
+# прежний формат истории и аварийный fallback бота (bot._safe_save_trade) — импортируется в датасет
 TRADES_CSV = Path("logs/trades.csv")
+# save_trade пишет файл на каждую сделку; набралось столько в партиции — сливаем их в один
+COMPACT_MAX_FILES = 32
+TRADE_COLS = ("ts", "symbol", "side", "qty", "price", "event", "sl", "tp", "score", "regime", "pnl")
+_FLOAT_COLS = {"qty", "price", "sl", "tp", "score", "pnl"}
 
+# в самих файлах колонки date нет — она берётся из имени партиции
+_FILE_SCHEMA = pa.schema([(c, pa.float64() if c in _FLOAT_COLS else pa.string()) for c in TRADE_COLS])
+TRADE_SCHEMA = _FILE_SCHEMA.append(pa.field("date", pa.string()))
+_PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+# чтение через mmap: страницы берутся из page cache без лишней копии в RAM
+_LOCAL_FS = pafs.LocalFileSystem(use_mmap=True)
+# сжатие партиции и чтение не должны пересекаться (save_trade зовут и из потоков пула);
+# запись новых файлов лока не требует — они появляются в партиции только готовыми (_write_file)
+_compact_lock = threading.Lock()
 
-def _ensure_dir():
-    TRADES_CSV.parent.mkdir(parents=True, exist_ok=True)
+logger = logging.getLogger(__name__)
 
 
-def load_trades(csv_path: Path = TRADES_CSV) -> pd.DataFrame:
-    """Загрузить историю сделок из CSV."""
+def _ensure_dir(root: Path = TRADES_DIR):
+    root.mkdir(parents=True, exist_ok=True)
+
+
+def _cell(col: str, value: Any) -> Any:
+    if value is None:
+        return None
+    if col in _FLOAT_COLS:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
+
+
+def _part_files(part: Path) -> list:
+    # _- и .-файлы — временные (их пропускает и ds.dataset)
+    return sorted(p for p in part.glob("*.parquet") if not p.name.startswith(("_", ".")))
+
+
+def _write_file(table: pa.Table, part: Path) -> None:
+    """Записать файл в партицию атомарно: временный _-файл, затем os.replace в итоговое имя."""
+    part.mkdir(parents=True, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.parquet"
+    tmp = part / f"_{name}"
+    pq.write_table(table, tmp)
+    os.replace(tmp, part / name)
+
+
+def _dataset(root: Path) -> Optional[ds.Dataset]:
+    if not root.exists():
+        return None
+    return ds.dataset(
+        str(root.resolve()), format="parquet", schema=TRADE_SCHEMA,
+        partitioning=_PARTITIONING, filesystem=_LOCAL_FS,
+    )
+
+
+def _import_csv(csv_path: Path, root: Path) -> None:
+    """
+    Перенести в датасет строки csv_path, дописанные после прошлого импорта (под _compact_lock).
+    Сколько байт уже импортировано — в <csv>.offset рядом: CSV не трогаем (fallback бота держит
+    его открытым на дозапись), а каждый вызов разбирает только новый хвост, не всю историю.
+    Падение между записью партиций и offset даст повторный импорт хвоста (дубли, не потерю).
+    """
     if not csv_path.exists():
-        return pd.DataFrame()
-    df = pd.read_csv(csv_path)
-    return df
+        return
+    offset_path = csv_path.with_name(csv_path.name + ".offset")
+    try:
+        done = int(offset_path.read_text())
+    except (OSError, ValueError):
+        done = 0
+    size = csv_path.stat().st_size
+    if done > size:  # файл пересоздан — начинаем сначала
+        done = 0
+    if done == size:
+        return
+
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        if not header.endswith(b"\n"):
+            return
+        f.seek(max(done, len(header)))
+        tail = f.read(size - max(done, len(header)))
+    tail = tail[: tail.rfind(b"\n") + 1]  # недописанную последнюю строку оставим до следующего раза
+    end = max(done, len(header)) + len(tail)
+
+    if tail:
+        df = pd.read_csv(io.BytesIO(header + tail), dtype=str, keep_default_na=False)
+        out = pd.DataFrame(index=df.index)
+        for c in TRADE_COLS:
+            col = df[c] if c in df.columns else pd.Series("", index=df.index, dtype=object)
+            if c in _FLOAT_COLS:
+                out[c] = pd.to_numeric(col, errors="coerce")
+            else:
+                out[c] = col.astype(object).where(col != "", None)
+        out = out[out["ts"].notna()]
+        for date, day in out.groupby(out["ts"].str[:10], sort=False):
+            table = pa.Table.from_pandas(day, schema=_FILE_SCHEMA, preserve_index=False)
+            _write_file(table, root / f"date={date}")
+
+    tmp = offset_path.with_name(offset_path.name + ".tmp")
+    tmp.write_text(str(end))
+    os.replace(tmp, offset_path)
+
+
+def load_trades(
+    root: Path = TRADES_DIR,
+    date: Optional[str] = None,
+    columns: Optional[Sequence[str]] = None,
+    csv_path: Path = TRADES_CSV,
+) -> pd.DataFrame:
+    """
+    Загрузить историю сделок (целиком или только за день date=YYYY-MM-DD).
+    columns — читать только эти колонки (остальные с диска не поднимаются).
+    Новые строки csv_path (старая история и fallback бота) сперва переносятся в датасет.
+    """
+    with _compact_lock:
+        try:
+            _import_csv(csv_path, root)
+        except Exception as e:
+            logger.warning(f"⚠️ trades.csv import error: {e}")
+        dataset = _dataset(root)
+        if dataset is None:
+            return pd.DataFrame()
+        flt = (ds.field("date") == date) if date is not None else None
+        df = dataset.to_table(columns=list(columns) if columns else None, filter=flt).to_pandas()
+    if "ts" not in df.columns:
+        return df
+    # файлы внутри партиции идут в произвольном порядке — упорядочим по времени
+    return df.sort_values("ts", kind="stable").reset_index(drop=True)
 
 
-def save_trade(trade: Dict, csv_path: Path = TRADES_CSV):
+def compact_partition(date: str, root: Path = TRADES_DIR) -> None:
     """
-    Сохраняем новую сделку (добавляем строку).
+    Слить файлы партиции date=YYYY-MM-DD в один (по времени сделок).
+    Сначала пишется слитый файл, затем удаляются исходные:
+    при падении посередине возможны дубли, но не потеря строк.
+    """
+    part = root / f"date={date}"
+    with _compact_lock:
+        if not part.is_dir():
+            return
+        files = _part_files(part)
+        if len(files) < 2:
+            return
+        table = pa.concat_tables([pq.read_table(f, schema=_FILE_SCHEMA) for f in files])
+        _write_file(table.sort_by("ts"), part)
+        for f in files:
+            f.unlink()
+
+
+def save_trade(trade: Dict, root: Path = TRADES_DIR):
+    """
+    Сохраняем новую сделку (новый файл в партиции текущего дня).
     Ожидаемые поля: ts, symbol, side, qty, price, event, sl, tp, score, regime, pnl
     Если ts не задан — проставим сейчас (UTC).
     """
-    _ensure_dir()
+    _ensure_dir(root)
     row = dict(trade)
     if "ts" not in row:
-        row["ts"] = pd.Timestamp.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
-    df = load_trades(csv_path)
-    new_df = pd.DataFrame([row])
-    cols = ["ts","symbol","side","qty","price","event","sl","tp","score","regime","pnl"]
-    for c in cols:
-        if c not in new_df.columns:
-            new_df[c] = None
-    if not df.empty:
-        for c in cols:
-            if c not in df.columns:
-                df[c] = None
-        df = df[cols]
-    out = pd.concat([df, new_df[cols]], ignore_index=True)
-    out.to_csv(csv_path, index=False)
-
-
-def daily_summary(csv_path: Path = TRADES_CSV) -> Dict[str, str]:
-    """
-    Краткий отчёт за сегодня: число записей, средний скор, суммарный PnL (если есть).
-    """
-    df = load_trades(csv_path)
-    if df.empty or "ts" not in df.columns:
-        return {"text": "Сегодня сделок не было."}
+        row["ts"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
 
+    rec = {c: _cell(c, row.get(c)) for c in TRADE_COLS}
+    date = str(rec["ts"])[:10]
+    part = root / f"date={date}"
+    _write_file(pa.Table.from_pylist([rec], schema=_FILE_SCHEMA), part)
+
+    # сделка уже на диске: сбой сжатия не должен выглядеть как неудачное сохранение
+    # (иначе bot._safe_save_trade продублирует строку в CSV)
     try:
-        df["date"] = pd.to_datetime(df["ts"]).dt.date
-    except Exception:
-        return {"text": "Сегодня сделок не было."}
+        with os.scandir(part) as it:
+            n_files = sum(1 for e in it if e.name.endswith(".parquet") and not e.name.startswith(("_", ".")))
+        if n_files >= COMPACT_MAX_FILES:
+            compact_partition(date, root)
+    except Exception as e:
+        logger.warning(f"⚠️ compact_partition error: {e}")
 
-    today = pd.Timestamp.utcnow().date()
-    day_df = df[df["date"] == today]
+
+def daily_summary(root: Path = TRADES_DIR, csv_path: Path = TRADES_CSV) -> Dict[str, str]:
+    """
+    Краткий отчёт за сегодня: число записей, средний скор, суммарный PnL (если есть).
+    Из датасета читается только партиция текущего дня (CSV — только новый хвост, см. _import_csv).
+    """
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+    day_df = load_trades(root, date=today, columns=("score", "pnl"), csv_path=csv_path)
     if day_df.empty:
         return {"text": "Сегодня сделок не было."}
 
     cnt = len(day_df)
-    avg_score = day_df["score"].astype(float).fillna(0).mean() if "score" in day_df else 0.0
-    pnl_sum = day_df["pnl"].astype(float).fillna(0).sum() if "pnl" in day_df else 0.0
+    avg_score = day_df["score"].fillna(0).mean()
+    pnl_sum = day_df["pnl"].fillna(0).sum()
 
     return {
         "text": f"Сделок: {cnt}\nСредний скоринг: {avg_score:.2f}\nСуммарный PnL (оценка): {pnl_sum:.2f} USDT"
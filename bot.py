@@ -1,7 +1,9 @@
 import os
+import csv
 import math
-import yaml
+import atexit
 import time
+import threading
 import asyncio
 import logging
 from logging.handlers import RotatingFileHandler
@@ -12,18 +14,21 @@ from pybit.unified_trading import HTTP
 
 import telegram_bot  # ВАЖНО: импортируем модуль целиком, чтобы видеть актуальный TRADING_ACTIVE
 
+from config import CFG
+from io_pool import IO_EXECUTOR, run_io
 from state import load_state, set_state, get_state
 from bybit_data import (
     fetch_kline, fetch_open_interest, fetch_funding_rate, fetch_basis,
-    fetch_long_short_ratio, fetch_wallet_equity, fetch_instrument_info,
-    fetch_available_balance
+    fetch_long_short_ratio, fetch_wallet_snapshot, get_instrument_info,
+    oi_to_array, candles_to_df,
 )
 from indicators import calculate_indicators
-from scoring import score_signal
-from regime import detect_regime
+from scoring import extract_features, score_features
+from regime import detect_regime_features
 from risk import (
     compute_position_size, place_market_order,
-    compute_initial_sl_tp, update_stops_and_partials, should_add_position
+    compute_initial_sl_tp, update_stops_and_partials, should_add_position,
+    set_qty_step, start_order_worker,
 )
 
 # --------- logging ----------
@@ -40,8 +45,7 @@ logger = logging.getLogger("bot")
 
 # --------- env / config ----------
 load_dotenv()
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+config = CFG
 
 SYMBOL = config.get("symbol", "BTCUSDT")
 TESTNET = bool(config.get("testnet", False))
@@ -63,6 +67,8 @@ FALLBACK_TP_PCT = float(config.get("fallback_tp_pct", 0.012))
 LAST_ENTRY_TS: Optional[float] = None
 LAST_ADD_TS: Optional[float] = None
 
+_LEVERAGE_SET = False
+
 # Для фиксации «полного выхода»
 _prev_has_pos = False
 _prev_side = None
@@ -76,55 +82,55 @@ session = HTTP(
     api_secret=os.getenv("BYBIT_API_SECRET"),
 )
 
+
 # --------- analytics safe import ----------
+_TRADES_FALLBACK_CSV = "logs/trades.csv"
+_TRADES_FALLBACK_COLS = ["ts","symbol","side","qty","price","event","sl","tp","score","regime","pnl"]
+_TRADES_FH = None
+_TRADES_W: Optional[csv.DictWriter] = None
+# _safe_save_trade вызывается и из event loop, и из потоков пула
+_TRADES_LOCK = threading.Lock()
+
+
+def _fallback_writer() -> csv.DictWriter:
+    """Открыть logs/trades.csv один раз и держать хэндл с готовым DictWriter (под _TRADES_LOCK)."""
+    global _TRADES_FH, _TRADES_W
+    if _TRADES_W is None:
+        os.makedirs("logs", exist_ok=True)
+        write_header = not os.path.exists(_TRADES_FALLBACK_CSV)
+        _TRADES_FH = open(_TRADES_FALLBACK_CSV, "a", newline="", encoding="utf-8")
+        _TRADES_W = csv.DictWriter(_TRADES_FH, fieldnames=_TRADES_FALLBACK_COLS)
+        if write_header:
+            _TRADES_W.writeheader()
+        atexit.register(_TRADES_FH.close)
+    return _TRADES_W
+
+
 def _safe_save_trade(row: Dict[str, Any]) -> None:
     try:
         from analytics import save_trade  # type: ignore
         save_trade(row)
     except Exception:
-        import csv
-        os.makedirs("logs", exist_ok=True)
-        fn = "logs/trades.csv"
-        header = ["ts","symbol","side","qty","price","event","sl","tp","score","regime","pnl"]
-        write_header = not os.path.exists(fn)
-        with open(fn, "a", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=header)
-            if write_header:
-                w.writeheader()
-            w.writerow({
-                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "symbol": row.get("symbol"),
-                "side": row.get("side"),
-                "qty": row.get("qty"),
-                "price": row.get("price"),
-                "event": row.get("event"),
-                "sl": row.get("sl"),
-                "tp": row.get("tp"),
-                "score": row.get("score"),
-                "regime": row.get("regime"),
-                "pnl": row.get("pnl"),
-            })
+        rec = {c: row.get(c) for c in _TRADES_FALLBACK_COLS}
+        # UTC, как в analytics.save_trade: оба потока читаются вместе и режутся по дню ts[:10]
+        rec["ts"] = row.get("ts") or time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with _TRADES_LOCK:
+            w = _fallback_writer()
+            w.writerow(rec)
+            _TRADES_FH.flush()
 
 
 def _ensure_leverage():
+    global _LEVERAGE_SET
+    if _LEVERAGE_SET:
+        return
     try:
         session.set_leverage(category="linear", symbol=SYMBOL, buyLeverage="10", sellLeverage="10")
+        _LEVERAGE_SET = True
     except Exception as e:
         logger.info(f"set_leverage: {e}")
 
 
-def candles_to_df(candles: list) -> pd.DataFrame:
-    if not candles:
-        return pd.DataFrame()
-    df = pd.DataFrame(candles, columns=["timestamp","open","high","low","close","volume","turnover"])
-    df["timestamp"] = pd.to_datetime(pd.to_numeric(df["timestamp"], errors="coerce"), unit="ms")
-    for c in ["open","high","low","close","volume","turnover"]:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-    df.sort_values("timestamp", inplace=True)
-    df.reset_index(drop=True, inplace=True)
-    return df
-
-
 def _has_open_position(sess: HTTP, symbol: str) -> Tuple[bool, Optional[dict]]:
     try:
         resp = sess.get_positions(category="linear", symbol=symbol)
@@ -148,26 +154,31 @@ def _has_open_position(sess: HTTP, symbol: str) -> Tuple[bool, Optional[dict]]:
 
 
 async def analyze_once() -> dict | None:
-    candles = fetch_kline(session, SYMBOL, LOWER_TF, 200)
+    # все запросы к Bybit независимы — отправляем их параллельно
+    candles, oi, funding, basis, lsr, (equity, avail) = await asyncio.gather(
+        run_io(fetch_kline, session, SYMBOL, LOWER_TF, 200),
+        run_io(fetch_open_interest, session, SYMBOL),
+        run_io(fetch_funding_rate, session, SYMBOL),
+        run_io(fetch_basis, session, SYMBOL),
+        run_io(fetch_long_short_ratio, session, SYMBOL),
+        run_io(fetch_wallet_snapshot, session, "USDT"),
+    )
     if not candles:
         logger.warning("⚠️ Нет свечей от Bybit")
         return None
     df = candles_to_df(candles)
     df = calculate_indicators(df)
 
-    metrics = {
-        "oi": fetch_open_interest(session, SYMBOL),
-        "funding": fetch_funding_rate(session, SYMBOL),
-        "basis": fetch_basis(session, SYMBOL),
-        "lsr": fetch_long_short_ratio(session, SYMBOL),
-    }
-    total, breakdown = score_signal(df, metrics)
-    regime = detect_regime(df, metrics)
-    last_price = float(df.iloc[-1]["close"])
-    equity = fetch_wallet_equity(session) or 1000.0
+    metrics = {"oi": oi, "oi_arr": oi_to_array(oi), "funding": funding, "basis": basis, "lsr": lsr}
+    features = extract_features(df, metrics)
+    total, breakdown = score_features(features)
+    regime = detect_regime_features(features)
+    last_row = df.iloc[-1]  # снимок последнего бара — один на цикл
+    last_price = float(last_row["close"])
+    equity = equity or 1000.0
     return {
-        "df": df, "metrics": metrics, "score": total, "breakdown": breakdown,
-        "regime": regime, "price": last_price, "equity": equity,
+        "df": df, "last_row": last_row, "metrics": metrics, "score": total, "breakdown": breakdown,
+        "regime": regime, "price": last_price, "equity": equity, "avail": avail,
     }
 
 
@@ -182,7 +193,8 @@ async def main_loop():
     global _prev_has_pos, _prev_side, _prev_size, _prev_entry
 
     load_state()
-    _ensure_leverage()
+    start_order_worker(IO_EXECUTOR)  # частичные TP / перенос SL уходят на биржу в фоне
+    await run_io(_ensure_leverage)
     await telegram_bot.send_telegram_message("🚀 Торговый цикл запущен (старт в СТОПЕ — включай /on)")
 
     while True:
@@ -197,19 +209,20 @@ async def main_loop():
                 await asyncio.sleep(10)
                 continue
 
-            df = res["df"]; price = res["price"]; equity = res["equity"]
+            last_row = res["last_row"]; price = res["price"]; equity = res["equity"]; avail = res["avail"]
             score = res["score"]; br = res["breakdown"]; regime = res["regime"]
+            now = time.time()  # одно «сейчас» на итерацию для всех cooldown-проверок
 
             logger.info(f"Score={score:+.2f} | TA={br['TA']:+.2f} | Data={br['BybitData']:+.2f} | Volume={br['Volume']:+.2f} | Volatility={br['Volatility']:+.2f} | Regime={regime}")
 
-            info = fetch_instrument_info(session, SYMBOL)
+            info, (has_pos, pos) = await asyncio.gather(
+                run_io(get_instrument_info, session, SYMBOL),
+                run_io(_has_open_position, session, SYMBOL),
+            )
             lot_step = float(info.get("lotSizeFilter", {}).get("qtyStep", 0.001)) if info else 0.001
             min_qty  = float(info.get("lotSizeFilter", {}).get("minOrderQty", 0.001)) if info else 0.001
             min_val  = float(info.get("lotSizeFilter", {}).get("minOrderAmt", 5.0)) if info else 5.0
-
-            avail = fetch_available_balance(session, "USDT")
-
-            has_pos, pos = _has_open_position(session, SYMBOL)
+            set_qty_step(SYMBOL, lot_step)
 
             # --------- Полный выход (была позиция → нет позиции) ----------
             if _prev_has_pos and not has_pos:
@@ -239,27 +252,29 @@ async def main_loop():
 
             # --------- Есть позиция: сопровождаем и (возможно) добираем ----------
             if has_pos and pos:
-                from risk import update_stops_and_partials, should_add_position, compute_position_size, place_market_order, compute_initial_sl_tp
                 side_pos = pos.get("side")
                 size_pos = float(pos.get("size") or 0)
                 entry = float(pos.get("avgPrice") or price)
 
+                loop = asyncio.get_running_loop()
+
                 def _on_partial(row: Dict[str, Any]):
+                    # вызывается из потока пула — сообщение отправляем в event loop потокобезопасно
                     row.update({"score": score, "regime": regime})
                     _safe_save_trade(row)
-                    asyncio.create_task(telegram_bot.send_telegram_message(
+                    asyncio.run_coroutine_threadsafe(telegram_bot.send_telegram_message(
                         f"🎯 Partial {row['event']}: {row['side']} {row['symbol']} qty={row['qty']}"
-                    ))
+                    ), loop)
 
-                update_stops_and_partials(
-                    session, SYMBOL, side_pos, entry, size_pos, price, df.iloc[-1],
-                    config, lot_step, on_partial=_on_partial
+                await run_io(
+                    update_stops_and_partials,
+                    session, SYMBOL, side_pos, entry, size_pos, price, last_row,
+                    config.raw, lot_step, _on_partial,
                 )
 
-                now = time.time()
                 can_cooldown = (LAST_ADD_TS is None) or (now - LAST_ADD_TS >= COOLDOWN_SEC)
                 if score > SIGNAL_THRESHOLD and avail >= min_val and can_cooldown:
-                    if should_add_position(SYMBOL, side_pos, price, df.iloc[-1], TRAILING, TRAIL_K_ATR):
+                    if should_add_position(SYMBOL, side_pos, price, last_row, TRAILING, TRAIL_K_ATR):
                         raw_qty = compute_position_size(
                             equity=equity, price=price, risk_pct=RISK_PCT,
                             min_qty=min_qty, qty_step=lot_step, min_order_value=min_val
@@ -269,7 +284,7 @@ async def main_loop():
                         qty = max(_round_down(qty, lot_step), 0.0)
 
                         if qty * price >= min_val and qty > 0:
-                            resp = place_market_order(session, SYMBOL, side_pos, qty)
+                            resp = await run_io(place_market_order, session, SYMBOL, side_pos, qty)
                             if isinstance(resp, dict) and resp.get("retCode") == 0:
                                 LAST_ADD_TS = now
                                 await telegram_bot.send_telegram_message(f"➕ Добор: {side_pos} {SYMBOL} qty={qty}")
@@ -288,7 +303,7 @@ async def main_loop():
             # --------- Нет позиции: возможен новый вход ----------
             if score > SIGNAL_THRESHOLD:
                 if COOLDOWN_SEC > 0 and LAST_ENTRY_TS:
-                    rest = COOLDOWN_SEC - (time.time() - LAST_ENTRY_TS)
+                    rest = COOLDOWN_SEC - (now - LAST_ENTRY_TS)
                     if rest > 0:
                         logger.info(f"Cooldown {rest:.0f}s — пропускаем вход")
                         await asyncio.sleep(15)
@@ -301,7 +316,6 @@ async def main_loop():
                     _prev_has_pos = False
                     continue
 
-                from risk import compute_position_size, place_market_order, compute_initial_sl_tp
                 raw_qty = compute_position_size(
                     equity=equity, price=price, risk_pct=RISK_PCT,
                     min_qty=min_qty, qty_step=lot_step, min_order_value=min_val
@@ -316,8 +330,8 @@ async def main_loop():
                     continue
 
                 side = "Buy" if br["TA"] >= 0 else "Sell"
-                last = df.iloc[-1]
-                atr = float(last.get("atr")) if pd.notna(last.get("atr")) else None
+                atr_v = last_row.get("atr")
+                atr = float(atr_v) if pd.notna(atr_v) else None
 
                 levels = compute_initial_sl_tp(
                     price, side, atr, ATR_K_SL, ATR_K_TP1, ATR_K_TP2,
@@ -327,11 +341,11 @@ async def main_loop():
                 tp = levels["tp2"]
 
                 logger.info(f"Вход: side={side} qty={qty} price≈{price:.2f} SL={sl} TP={tp} (avail≈{avail:.2f})")
-                resp = place_market_order(session, SYMBOL, side, qty, stop_loss=sl, take_profit=tp)
+                resp = await run_io(place_market_order, session, SYMBOL, side, qty, sl, tp)
                 if isinstance(resp, dict) and resp.get("retCode") == 0:
                     LAST_ENTRY_TS = time.time()
 
-                    _, p = _has_open_position(session, SYMBOL)
+                    _, p = await run_io(_has_open_position, session, SYMBOL)
                     avg = float(p.get("avgPrice")) if p and p.get("avgPrice") else price
 
                     set_state(SYMBOL, "entry_price", avg)
@@ -1,5 +1,8 @@
 import logging
-from typing import List, Dict, Any, Optional
+import time
+import numpy as np
+import pandas as pd
+from typing import List, Dict, Any, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +15,35 @@ def fetch_kline(session, symbol: str, interval: str = "1", limit: int = 200) ->
         logger.warning(f"⚠️ fetch_kline error: {e}")
     return []
 
+_CANDLE_COLS = ("timestamp", "open", "high", "low", "close", "volume", "turnover")
+
+def candles_to_df(candles: list) -> pd.DataFrame:
+    if not candles:
+        return pd.DataFrame()
+    # список строк Bybit → колонки float64 (один разбор на колонку)
+    try:
+        cols = [np.asarray(col, dtype=np.float64) for col in zip(*candles)]
+    except (TypeError, ValueError):
+        return _candles_to_df_coerce(candles)
+    ts = cols[0]
+    # V5 отдаёт свечи от новых к старым — обычно достаточно развернуть
+    order = slice(None, None, -1) if ts[0] > ts[-1] else slice(None)
+    if np.any(np.diff(ts[order]) < 0):
+        order = np.argsort(ts, kind="stable")
+    data = {name: col[order] for name, col in zip(_CANDLE_COLS, cols)}
+    data["timestamp"] = pd.to_datetime(data["timestamp"], unit="ms")
+    return pd.DataFrame(data)
+
+def _candles_to_df_coerce(candles: list) -> pd.DataFrame:
+    """Медленный путь для «грязных» ответов: нечисловые значения → NaN."""
+    df = pd.DataFrame(candles, columns=list(_CANDLE_COLS))
+    df["timestamp"] = pd.to_datetime(pd.to_numeric(df["timestamp"], errors="coerce"), unit="ms")
+    for c in _CANDLE_COLS[1:]:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    df.sort_values("timestamp", inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    return df
+
 def fetch_open_interest(session, symbol: str, interval_time: str = "5min") -> List[dict]:
     try:
         resp = session.get_open_interest(category="linear", symbol=symbol, intervalTime=interval_time)
@@ -21,6 +53,22 @@ def fetch_open_interest(session, symbol: str, interval_time: str = "5min") -> Li
         logger.warning(f"⚠️ fetch_open_interest error: {e}")
     return []
 
+def oi_to_array(oi_list: List[Any], last_n: int = 10) -> np.ndarray:
+    """
+    Последние last_n значений OI → float64-массив.
+    V5 обычно отдает dict c ключом openInterest, но бывает список [ts, value, ...].
+    Если что-то не парсится — пустой массив (как «OI не растёт»).
+    """
+    try:
+        vals = []
+        for x in oi_list[-last_n:]:
+            v = x.get("openInterest") if isinstance(x, dict) else (x[1] if len(x) > 1 else None)
+            if v is not None:
+                vals.append(float(v))
+        return np.asarray(vals, dtype=np.float64)
+    except Exception:
+        return np.empty(0, dtype=np.float64)
+
 def fetch_funding_rate(session, symbol: str) -> Optional[float]:
     try:
         resp = session.get_funding_rate_history(category="linear", symbol=symbol, limit=1)
@@ -54,18 +102,6 @@ def fetch_long_short_ratio(session, symbol: str, period: str = "5min") -> List[D
         logger.warning(f"⚠️ fetch_long_short_ratio error: {e}")
     return []
 
-def fetch_wallet_equity(session) -> Optional[float]:
-    try:
-        resp = session.get_wallet_balance(accountType="UNIFIED")
-        if resp.get("retCode") == 0:
-            lst = resp.get("result", {}).get("list", [])
-            if lst:
-                eq = lst[0].get("totalEquity")
-                return float(eq) if eq is not None else None
-    except Exception as e:
-        logger.warning(f"⚠️ fetch_wallet_equity error: {e}")
-    return None
-
 def fetch_instrument_info(session, symbol: str) -> Dict[str, Any]:
     try:
         resp = session.get_instruments_info(category="linear", symbol=symbol)
@@ -76,21 +112,55 @@ def fetch_instrument_info(session, symbol: str) -> Dict[str, Any]:
         logger.warning(f"⚠️ fetch_instrument_info error: {e}")
     return {}
 
-def fetch_available_balance(session, coin: str = "USDT") -> float:
+# фильтры инструмента (lotSizeFilter) внутри дня не меняются — общий кэш на процесс
+INSTR_CACHE_TTL = 3600.0
+_INSTR_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+def get_instrument_info(session, symbol: str, ttl: float = INSTR_CACHE_TTL) -> Dict[str, Any]:
+    """fetch_instrument_info() с кэшем на ttl секунд (пустой ответ не кэшируется)."""
+    now = time.monotonic()
+    hit = _INSTR_CACHE.get(symbol)
+    if hit and now - hit[0] < ttl:
+        return hit[1]
+    info = fetch_instrument_info(session, symbol)
+    if info:
+        _INSTR_CACHE[symbol] = (now, info)
+    else:
+        # ошибка/пустой ответ — сбрасываем кэш, повторим при следующем запросе
+        _INSTR_CACHE.pop(symbol, None)
+    return info
+
+def fetch_wallet_snapshot(session, coin: str = "USDT") -> Tuple[Optional[float], float]:
     """
-    Доступные средства (available) по монете.
-    V5 wallet-balance: result.list[0].coin[].availableToTrade.walletBalance
+    Equity и доступные средства по монете из одного запроса wallet-balance.
+    V5: result.list[0].totalEquity и result.list[0].coin[].availableToTrade.walletBalance
+    Возвращает (totalEquity | None, availableToTrade.walletBalance | 0.0);
+    поля разбираются независимо — битое одно не обнуляет другое.
     """
+    equity: Optional[float] = None
+    avail = 0.0
     try:
         resp = session.get_wallet_balance(accountType="UNIFIED")
-        if resp.get("retCode") == 0:
-            lst = (resp.get("result") or {}).get("list", [])
-            if lst:
-                coins = lst[0].get("coin", []) or []
-                for c in coins:
-                    if c.get("coin") == coin:
-                        at = (c.get("availableToTrade") or {}).get("walletBalance")
-                        return float(at or 0.0)
+        if resp.get("retCode") != 0:
+            return equity, avail
+        lst = (resp.get("result") or {}).get("list", []) or []
+    except Exception as e:
+        logger.warning(f"⚠️ fetch_wallet_snapshot error: {e}")
+        return equity, avail
+    if not lst:
+        return equity, avail
+    acc = lst[0]
+    try:
+        eq = acc.get("totalEquity")
+        equity = float(eq) if eq is not None else None
+    except Exception as e:
+        logger.warning(f"⚠️ fetch_wallet_snapshot totalEquity error: {e}")
+    try:
+        for c in acc.get("coin", []) or []:
+            if c.get("coin") == coin:
+                at = (c.get("availableToTrade") or {}).get("walletBalance")
+                avail = float(at or 0.0)
+                break
     except Exception as e:
-        logger.warning(f"⚠️ fetch_available_balance error: {e}")
-    return 0.0
+        logger.warning(f"⚠️ fetch_wallet_snapshot {coin} available error: {e}")
+    return equity, avail
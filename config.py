@@ -0,0 +1,51 @@
+import logging
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Mapping
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = "config.yaml"
+
+# libyaml-парсер заметно быстрее чисто-питоновского SafeLoader (если собран)
+try:
+    from yaml import CSafeLoader as _YAML_LOADER
+except ImportError:
+    from yaml import SafeLoader as _YAML_LOADER
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """
+    Содержимое config.yaml, разобранное один раз на процесс.
+    Верхний уровень — только для чтения; get() — как у dict.
+    """
+    raw: Mapping[str, Any]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.raw.get(key, default)
+
+
+@lru_cache(maxsize=1)
+def load(path: str = CONFIG_FILE) -> Config:
+    """Прочитать config.yaml (кэшируется); нет файла/ошибка разбора — пустой конфиг (дефолты модулей)."""
+    raw: dict = {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                raw = yaml.load(f, Loader=_YAML_LOADER) or {}
+            if not isinstance(raw, dict):
+                raise ValueError("ожидается mapping на верхнем уровне")
+        except Exception as e:
+            logger.warning(f"⚠️ config load error: {e}")
+            raw = {}
+    else:
+        logger.warning(f"⚠️ {path} не найден — используем значения по умолчанию")
+    return Config(raw=MappingProxyType(raw))
+
+
+CFG = load()
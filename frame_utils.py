@@ -0,0 +1,24 @@
+import math
+from typing import Any
+
+import pandas as pd
+
+
+def last_float(x: Any, default: float = 0.0) -> float:
+    """Скаляр или последний элемент списка → float; None/не парсится → default."""
+    try:
+        if isinstance(x, list) and x:
+            x = x[-1]
+        if x is None:
+            return default
+        return float(x)
+    except Exception:
+        return default
+
+
+def last_value(df: pd.DataFrame, name: str, default: float = math.nan) -> float:
+    """Последнее значение колонки как float (None → NaN); нет колонки → default."""
+    if name not in df.columns:
+        return default
+    x = df[name].to_numpy()[-1]
+    return math.nan if x is None else float(x)
@@ -1,131 +1,300 @@
-import os
-import yaml
 import numpy as np
 import pandas as pd
-from ta.trend import EMAIndicator, ADXIndicator
-from ta.momentum import RSIIndicator
-from ta.volatility import AverageTrueRange
+from numba import njit
 
-# читаем параметры супер-тренда из config.yaml (если нет — используем дефолты)
+from config import CFG
+from jit_utils import warm_up
+
+# параметры супер-тренда из config.yaml (если нет — используем дефолты)
 ST_PERIOD = 10
 ST_MULTIPLIER = 3.0
-if os.path.exists("config.yaml"):
-    try:
-        _cfg = yaml.safe_load(open("config.yaml", "r"))
-        ST_PERIOD = int(_cfg.get("supertrend_period", ST_PERIOD))
-        ST_MULTIPLIER = float(_cfg.get("supertrend_multiplier", ST_MULTIPLIER))
-    except Exception:
-        pass
+try:
+    ST_PERIOD = int(CFG.get("supertrend_period", ST_PERIOD))
+    ST_MULTIPLIER = float(CFG.get("supertrend_multiplier", ST_MULTIPLIER))
+except Exception:
+    pass
+
 
+def _true_range(high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
+    """TR = max(high-low, |high-prev_close|, |low-prev_close|); на первом баре — high-low."""
+    prev_close = close.shift(1)
+    return pd.concat(
+        [high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1
+    ).max(axis=1)
 
-def _supertrend(df: pd.DataFrame, period: int, multiplier: float) -> pd.DataFrame:
+
+@njit(cache=True)
+def _atr_core(tr, window):
     """
-    Классический SuperTrend:
-      1) ATR(period)
-      2) basic_ub/lb = (high+low)/2 ± multiplier*ATR
-      3) final_ub/lb (скользящие барьеры)
-      4) линия supertrend и направление
+    ATR Уайлдера — дословно цикл ta.volatility.AverageTrueRange:
+      - на баре window-1 — среднее TR за первые window баров (NaN пропускаются, как в pandas mean);
+      - далее atr[i] = (atr[i-1] * (window-1) + tr[i]) / window — NaN в TR тянется дальше;
+      - до window-1 — нули (ta не отдаёт NaN на прогреве).
+    """
+    n = tr.shape[0]
+    out = np.zeros(n, dtype=np.float64)
+    if n < window:
+        return out
+    acc = 0.0
+    cnt = 0
+    for j in range(window):
+        if not np.isnan(tr[j]):
+            acc += tr[j]
+            cnt += 1
+    out[window - 1] = acc / cnt if cnt > 0 else np.nan
+    for i in range(window, n):
+        out[i] = (out[i - 1] * (window - 1) + tr[i]) / window
+    return out
+
+
+@njit(cache=True)
+def _wilder_sum(x, window):
+    """
+    Сумма Уайлдера из ta.trend.ADXIndicator: s[0] — сумма первых window не-NaN значений,
+    далее s[i] = s[i-1] - s[i-1] / window + x[window + i]; последний элемент ta оставляет нулём.
+    """
+    m = x.shape[0] - (window - 1)
+    out = np.zeros(m, dtype=np.float64)
+    acc = 0.0
+    taken = 0
+    for j in range(x.shape[0]):
+        if taken == window:
+            break
+        if not np.isnan(x[j]):
+            acc += x[j]
+            taken += 1
+    out[0] = acc
+    for i in range(1, m - 1):
+        out[i] = out[i - 1] - out[i - 1] / window + x[window + i]
+    return out
+
+
+@njit(cache=True)
+def _adx_core(high, low, close, window):
+    """
+    ADX — дословно ta.trend.ADXIndicator.adx() (fillna=False), включая NaN-семантику:
+    диапазон max(high, prev_close) - min(low, prev_close) и DM с NaN-баром дают NaN,
+    который рекурсии несут дальше; деления с нулевым знаменателем — 0.
     """
-    st = df.copy()
+    n = close.shape[0]
+    out = np.zeros(n, dtype=np.float64)
+    m = n - (window - 1)
+    if m <= window:
+        return out
+
+    ddm = np.empty(n, dtype=np.float64)
+    pos = np.empty(n, dtype=np.float64)
+    neg = np.empty(n, dtype=np.float64)
+    ddm[0] = np.nan
+    pos[0] = np.nan
+    neg[0] = np.nan
+    for i in range(1, n):
+        pc = close[i - 1]
+        if np.isnan(high[i]) or np.isnan(low[i]) or np.isnan(pc):
+            ddm[i] = np.nan
+        else:
+            ddm[i] = max(high[i], pc) - min(low[i], pc)
+        up = high[i] - high[i - 1]
+        down = low[i - 1] - low[i]
+        # (cond) * diff: NaN в diff даёт NaN, False * число — 0
+        pos[i] = np.nan if np.isnan(up) else (abs(up) if (up > down and up > 0) else 0.0)
+        neg[i] = np.nan if np.isnan(down) else (abs(down) if (down > up and down > 0) else 0.0)
+
+    trs = _wilder_sum(ddm, window)
+    dip_s = _wilder_sum(pos, window)
+    din_s = _wilder_sum(neg, window)
+
+    dx = np.zeros(m, dtype=np.float64)
+    for k in range(m):
+        t = trs[k]
+        dip = 100.0 * (dip_s[k] / t) if t != 0 else 0.0
+        din = 100.0 * (din_s[k] / t) if t != 0 else 0.0
+        sm = dip + din
+        dx[k] = 100.0 * abs((dip - din) / sm) if sm != 0 else 0.0
+
+    adx = np.zeros(m, dtype=np.float64)
+    acc = 0.0
+    for k in range(window):
+        acc += dx[k]
+    adx[window] = acc / window  # np.mean: NaN не пропускается
+    for k in range(window + 1, m):
+        adx[k] = (adx[k - 1] * (window - 1) + dx[k - 1]) / window
+
+    out[window - 1:] = adx
+    return out
+
+
+def _atr(tr: pd.Series, window: int) -> pd.Series:
+    """ATR(window) из готового TR — как ta.volatility.AverageTrueRange."""
+    return pd.Series(_atr_core(tr.to_numpy(dtype=np.float64), window), index=tr.index)
 
-    atr_ind = AverageTrueRange(
-        high=st["high"], low=st["low"], close=st["close"], window=period, fillna=False
+
+def _rsi(close: pd.Series, window: int = 14) -> pd.Series:
+    """RSI Уайлдера — как ta.momentum.RSIIndicator (fillna=False)."""
+    diff = close.diff(1)
+    up = diff.where(diff > 0, 0.0)
+    down = -diff.where(diff < 0, 0.0)
+    emaup = up.ewm(alpha=1.0 / window, min_periods=window, adjust=False).mean()
+    emadn = down.ewm(alpha=1.0 / window, min_periods=window, adjust=False).mean()
+    rsi = np.where(emadn == 0, 100.0, 100.0 - 100.0 / (1.0 + emaup / emadn))
+    return pd.Series(rsi, index=close.index)
+
+
+def _adx(high: pd.Series, low: pd.Series, close: pd.Series, window: int = 14) -> pd.Series:
+    """ADX Уайлдера — как ta.trend.ADXIndicator.adx() (fillna=False)."""
+    adx = _adx_core(
+        high.to_numpy(dtype=np.float64),
+        low.to_numpy(dtype=np.float64),
+        close.to_numpy(dtype=np.float64),
+        window,
     )
-    atr = atr_ind.average_true_range()
+    return pd.Series(adx, index=high.index)
 
-    hl2 = (st["high"] + st["low"]) / 2.0
-    st["basic_ub"] = hl2 + multiplier * atr
-    st["basic_lb"] = hl2 - multiplier * atr
 
-    final_ub = st["basic_ub"].copy()
-    final_lb = st["basic_lb"].copy()
+@njit(cache=True)
+def _supertrend_core(high, low, close, basic_ub, basic_lb):
+    """
+    Ядро SuperTrend на голых float64-массивах (скомпилировано Numba).
+    Возвращает (st_line, final_ub, final_lb, st_dir).
+    Сравнения расписаны явно — так же, как вели себя min/max на NaN в исходных циклах.
+    """
+    n = close.shape[0]
+    final_ub = basic_ub.copy()
+    final_lb = basic_lb.copy()
 
-    for i in range(1, len(st)):
+    for i in range(1, n):
         # верхняя
-        if st["close"].iloc[i-1] > final_ub.iloc[i-1]:
-            final_ub.iloc[i] = st["basic_ub"].iloc[i]
+        if close[i-1] > final_ub[i-1]:
+            final_ub[i] = basic_ub[i]
+        elif final_ub[i-1] < basic_ub[i]:
+            final_ub[i] = final_ub[i-1]
         else:
-            final_ub.iloc[i] = min(st["basic_ub"].iloc[i], final_ub.iloc[i-1])
+            final_ub[i] = basic_ub[i]
 
         # нижняя
-        if st["close"].iloc[i-1] < final_lb.iloc[i-1]:
-            final_lb.iloc[i] = st["basic_lb"].iloc[i]
+        if close[i-1] < final_lb[i-1]:
+            final_lb[i] = basic_lb[i]
+        elif final_lb[i-1] > basic_lb[i]:
+            final_lb[i] = final_lb[i-1]
         else:
-            final_lb.iloc[i] = max(st["basic_lb"].iloc[i], final_lb.iloc[i-1])
-
-    st_dir = np.ones(len(st), dtype=int)
-    st_line = pd.Series(index=st.index, dtype="float64")
+            final_lb[i] = basic_lb[i]
 
-    for i in range(len(st)):
-        if i == 0:
-            st_line.iloc[i] = final_lb.iloc[i]
-            st_dir[i] = 1
-            continue
+    st_dir = np.ones(n, dtype=np.int64)
+    st_line = np.empty(n, dtype=np.float64)
+    if n == 0:
+        return st_line, final_ub, final_lb, st_dir
 
-        prev_line = st_line.iloc[i-1]
-        if (prev_line == final_ub.iloc[i-1]) and (st["close"].iloc[i] <= final_ub.iloc[i]):
-            st_line.iloc[i] = final_ub.iloc[i]
+    st_line[0] = final_lb[0]
+    for i in range(1, n):
+        prev_line = st_line[i-1]
+        if (prev_line == final_ub[i-1]) and (close[i] <= final_ub[i]):
+            st_line[i] = final_ub[i]
             st_dir[i] = -1
-        elif (prev_line == final_ub.iloc[i-1]) and (st["close"].iloc[i] > final_ub.iloc[i]):
-            st_line.iloc[i] = final_lb.iloc[i]
+        elif (prev_line == final_ub[i-1]) and (close[i] > final_ub[i]):
+            st_line[i] = final_lb[i]
             st_dir[i] = 1
-        elif (prev_line == final_lb.iloc[i-1]) and (st["close"].iloc[i] >= final_lb.iloc[i]):
-            st_line.iloc[i] = final_lb.iloc[i]
+        elif (prev_line == final_lb[i-1]) and (close[i] >= final_lb[i]):
+            st_line[i] = final_lb[i]
             st_dir[i] = 1
-        elif (prev_line == final_lb.iloc[i-1]) and (st["close"].iloc[i] < final_lb.iloc[i]):
-            st_line.iloc[i] = final_ub.iloc[i]
+        elif (prev_line == final_lb[i-1]) and (close[i] < final_lb[i]):
+            st_line[i] = final_ub[i]
             st_dir[i] = -1
         else:
-            st_line.iloc[i] = final_lb.iloc[i]
+            st_line[i] = final_lb[i]
             st_dir[i] = 1
 
-    out = pd.DataFrame(index=st.index)
-    out["supertrend"] = st_line
-    out["supertrend_upper"] = final_ub
-    out["supertrend_lower"] = final_lb
-    out["supertrend_dir"] = st_dir
-    return out
+    return st_line, final_ub, final_lb, st_dir
+
+
+_warm = np.zeros(2, dtype=np.float64)
+warm_up(_supertrend_core, _warm, _warm, _warm, _warm, _warm)
+warm_up(_atr_core, _warm, 14)
+warm_up(_adx_core, _warm, _warm, _warm, 14)
+del _warm
+
+
+def _supertrend(df: pd.DataFrame, atr: pd.Series, multiplier: float) -> pd.DataFrame:
+    """
+    Классический SuperTrend:
+      1) ATR(period) — считается снаружи и передаётся готовым
+      2) basic_ub/lb = (high+low)/2 ± multiplier*ATR
+      3) final_ub/lb (скользящие барьеры)
+      4) линия supertrend и направление
+    Циклы 3–4 выполняются в _supertrend_core. df только читается (без копии).
+    """
+    # все промежуточные ряды — голые массивы, в pandas заворачиваем только результат
+    high = df["high"].to_numpy(dtype=np.float64)
+    low = df["low"].to_numpy(dtype=np.float64)
+    close = df["close"].to_numpy(dtype=np.float64)
+    atr_a = atr.to_numpy(dtype=np.float64)
+
+    hl2 = (high + low) / 2.0
+    basic_ub = hl2 + multiplier * atr_a
+    basic_lb = hl2 - multiplier * atr_a
+
+    st_line, final_ub, final_lb, st_dir = _supertrend_core(high, low, close, basic_ub, basic_lb)
+
+    return pd.DataFrame(
+        {
+            "supertrend": st_line,
+            "supertrend_upper": final_ub,
+            "supertrend_lower": final_lb,
+            "supertrend_dir": st_dir,
+        },
+        index=df.index,
+    )
 
 
 def calculate_indicators(df: pd.DataFrame) -> pd.DataFrame:
     """
     EMA(9,21,50,200), RSI(14), ADX(14), ATR(14), VWAP, OBV, VolMA(20),
     + классический SuperTrend (параметры из config.yaml).
+    Колонки добавляются в переданный df на месте (без копии) — вызывающий
+    владеет фреймом (candles_to_df создаёт новый на каждый цикл); возвращается тот же df.
     """
-    df = df.copy()
+
+    # True Range — общий для ATR(14) и ATR SuperTrend
+    tr = _true_range(df["high"], df["low"], df["close"])
 
     # EMA
     for p in [9, 21, 50, 200]:
-        df[f"ema_{p}"] = EMAIndicator(close=df["close"], window=p, fillna=False).ema_indicator()
+        df[f"ema_{p}"] = df["close"].ewm(span=p, min_periods=p, adjust=False).mean()
 
     # RSI / ADX / ATR
-    df["rsi"] = RSIIndicator(close=df["close"], window=14, fillna=False).rsi()
-    adx_ind = ADXIndicator(high=df["high"], low=df["low"], close=df["close"], window=14, fillna=False)
-    df["adx"] = adx_ind.adx()
-    atr_ind = AverageTrueRange(high=df["high"], low=df["low"], close=df["close"], window=14, fillna=False)
-    df["atr"] = atr_ind.average_true_range()
-
-    # VWAP (простая кумулятивная)
-    tp = (df["high"] + df["low"] + df["close"]) / 3.0
-    vol = df["volume"].replace(0, np.nan)
-    df["vwap"] = (tp * vol).cumsum() / vol.cumsum()
-
-    # OBV
-    obv = [0.0]
-    for i in range(1, len(df)):
-        if df["close"].iloc[i] > df["close"].iloc[i-1]:
-            obv.append(obv[-1] + df["volume"].iloc[i])
-        elif df["close"].iloc[i] < df["close"].iloc[i-1]:
-            obv.append(obv[-1] - df["volume"].iloc[i])
-        else:
-            obv.append(obv[-1])
+    df["rsi"] = _rsi(df["close"], 14)
+    df["adx"] = _adx(df["high"], df["low"], df["close"], 14)
+    df["atr"] = _atr(tr, 14)
+
+    # VWAP (простая кумулятивная); бары с нулевым объёмом пропускаем (NaN),
+    # nancumsum + маска повторяют семантику pandas cumsum(skipna=True)
+    vol_a = df["volume"].to_numpy(dtype=np.float64)
+    vol_nz = np.where(vol_a > 0, vol_a, np.nan)
+    tp = (
+        df["high"].to_numpy(dtype=np.float64)
+        + df["low"].to_numpy(dtype=np.float64)
+        + df["close"].to_numpy(dtype=np.float64)
+    ) / 3.0
+    pv = tp * vol_nz
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vwap = np.nancumsum(pv) / np.nancumsum(vol_nz)
+    vwap[np.isnan(pv)] = np.nan
+    df["vwap"] = vwap
+
+    # OBV: sign(Δclose) ∈ {-1, 0, +1} * volume, накопленной суммой
+    close = df["close"].to_numpy(dtype=np.float64)
+    volume = df["volume"].to_numpy(dtype=np.float64)
+    sign = np.nan_to_num(np.sign(np.diff(close)))  # NaN-сравнение = «без изменений»
+    obv = np.empty_like(close)
+    obv[:1] = 0.0
+    np.cumsum(sign * volume[1:], out=obv[1:])
     df["obv"] = obv
 
     # Volume MA
     df["vol_ma_20"] = df["volume"].rolling(20, min_periods=1).mean()
 
     # SuperTrend (классический)
-    st = _supertrend(df[["high", "low", "close"]], period=ST_PERIOD, multiplier=ST_MULTIPLIER)
+    atr_st = df["atr"] if ST_PERIOD == 14 else _atr(tr, ST_PERIOD)
+    st = _supertrend(df, atr=atr_st, multiplier=ST_MULTIPLIER)
     for c in ["supertrend", "supertrend_upper", "supertrend_lower", "supertrend_dir"]:
         df[c] = st[c]
 
@@ -0,0 +1,17 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# один пул на процесс для синхронных REST-вызовов pybit (торговый цикл, очередь заявок, telegram)
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pybit")
+
+
+async def run_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Выполнить блокирующий вызов (pybit, расчёт индикаторов) в IO_EXECUTOR, не блокируя event loop.
+    Асинхронного клиента в pybit нет; HTTP держит один requests.Session
+    (keep-alive), поэтому поток из пула переиспользует готовые соединения.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(IO_EXECUTOR, functools.partial(fn, *args, **kwargs))
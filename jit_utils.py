@@ -0,0 +1,11 @@
+from typing import Any, Callable
+
+
+def warm_up(kernel: Callable[..., Any], *args: Any) -> None:
+    """
+    Один раз вызвать njit-ядро при импорте модуля на типичных аргументах.
+    Компиляция (или загрузка из кэша cache=True) происходит здесь, при старте бота,
+    а не на первом тике торгового цикла. Типы аргументов должны совпадать с боевыми
+    (float64 / массивы float64), иначе в цикле скомпилируется ещё одна специализация.
+    """
+    kernel(*args)
@@ -1,7 +1,9 @@
 # news_sentiment.py
 import os
+import orjson
 import requests
 import time
+import ahocorasick
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +11,20 @@ load_dotenv()
 CRYPTOPANIC_KEY = os.getenv("CRYPTOPANIC_KEY")
 BASE_URL = "https://cryptopanic.com/api/developer/v2/posts/"
 
+# одна сессия на модуль — keep-alive, без нового TCP/TLS-рукопожатия на каждый опрос
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept-Encoding": "gzip"})
+
+# ключевые слова → знак; один автомат Ахо–Корасик находит все вхождения за проход по заголовку
+_KEYWORDS = {
+    "surge": 1, "bull": 1, "positive": 1, "growth": 1, "rally": 1,
+    "drop": -1, "bear": -1, "negative": -1, "crash": -1, "fear": -1,
+}
+_AUTOMATON = ahocorasick.Automaton()
+for _word, _sign in _KEYWORDS.items():
+    _AUTOMATON.add_word(_word, _sign)
+_AUTOMATON.make_automaton()
+
 # кэш новостей
 _last_fetch_time = 0
 _cached_news_signal = "neutral"
@@ -36,18 +52,17 @@ def get_news_signal(symbol: str = "BTC") -> str:
             "kind": "news",
             "limit": 50
         }
-        resp = requests.get(BASE_URL, params=params, timeout=10)
+        resp = _SESSION.get(BASE_URL, params=params, timeout=10)
         resp.raise_for_status()
-        data = resp.json()
+        data = orjson.loads(resp.content)
 
         posts = data.get("results", [])
         score = 0
         for post in posts:
             title = (post.get("title") or "").lower()
-            if any(word in title for word in ["surge", "bull", "positive", "growth", "rally"]):
-                score += 1
-            if any(word in title for word in ["drop", "bear", "negative", "crash", "fear"]):
-                score -= 1
+            # как и раньше: не больше ±1 за каждую группу слов на заголовок
+            hits = {sign for _, sign in _AUTOMATON.iter(title)}
+            score += (1 in hits) - (-1 in hits)
 
         if score > 2:
             signal = "bullish"
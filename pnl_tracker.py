@@ -1,4 +1,5 @@
 import os
+import numpy as np
 import pandas as pd
 
 def update_trades_with_pnl():
@@ -8,18 +9,18 @@ def update_trades_with_pnl():
         df = pd.read_csv("trades.csv")
         if df.empty or "exit_price" not in df.columns:
             return None
-        updated = 0
-        for i, row in df.iterrows():
-            if pd.isna(row.get("exit_price")):
-                continue
-            entry = float(row["entry"]); exit_p = float(row["exit_price"]); qty = float(row["qty"])
-            pnl_usd = (exit_p - entry) * qty if row["side"] == "long" else (entry - exit_p) * qty
-            pnl_pct = (pnl_usd / (entry * qty)) * 100
-            df.at[i, "pnl_usd"] = pnl_usd
-            df.at[i, "pnl_pct"] = pnl_pct
-            df.at[i, "result"] = "win" if pnl_usd > 0 else "loss"
-            updated += 1
+        mask = df["exit_price"].notna().to_numpy()
+        updated = int(mask.sum())
         if updated > 0:
+            sub = df.loc[mask]
+            entry = sub["entry"].astype(float).to_numpy()
+            exit_p = sub["exit_price"].astype(float).to_numpy()
+            qty = sub["qty"].astype(float).to_numpy()
+            pnl_usd = np.where(sub["side"].eq("long").to_numpy(), exit_p - entry, entry - exit_p) * qty
+            pnl_pct = (pnl_usd / (entry * qty)) * 100
+            df.loc[mask, "pnl_usd"] = pnl_usd
+            df.loc[mask, "pnl_pct"] = pnl_pct
+            df.loc[mask, "result"] = np.where(pnl_usd > 0, "win", "loss")
             df.to_csv("trades.csv", index=False)
             return f"Обновлено {updated} сделок"
     except Exception as e:
@@ -1,48 +1,67 @@
+import math
 import numpy as np
 import pandas as pd
+from numba import njit
 
+from bybit_data import oi_to_array
+from frame_utils import last_float, last_value
+from jit_utils import warm_up
+from scoring import FeatureView
 
-def detect_regime(df: pd.DataFrame, metrics: dict) -> str:
+
+# индекс, который возвращает _regime_kernel
+_REGIMES = ("neutral", "trend", "mean-reversion")
+
+
+@njit(cache=True)
+def _regime_kernel(adx, ema9, ema21, ema50, basis, oi_last, oi_mean_prev):
+    # NaN в сравнениях даёт False — отсутствующие EMA/ADX/basis/OI не включают режим
+    trend_stack = ema9 > ema21 and ema21 > ema50
+    oi_rising = oi_last > oi_mean_prev
+    if adx > 25.0 and trend_stack and (basis > 0 or oi_rising):
+        return 1
+    if adx < 18.0 and (np.isnan(basis) or abs(basis) < 1e-6):
+        return 2
+    return 0
+
+
+def detect_regime_features(f: FeatureView) -> str:
     """
     Простой классификатор режима:
     - trend: ADX>25 и EMA9>EMA21>EMA50, basis>0, OI растет
     - mean-reversion: ADX<18 и basis≈0
     - иначе: neutral
     """
-    if df.empty:
+    return _classify(f.adx, f.ema9, f.ema21, f.ema50, f.basis, f.oi_arr)
+
+
+def _classify(adx: float, ema9: float, ema21: float, ema50: float, basis: float, oi_arr: np.ndarray) -> str:
+    # среднее считает numpy (как раньше), ядру — только скаляры
+    if oi_arr.size >= 2:
+        oi_last, oi_mean_prev = float(oi_arr[-1]), float(oi_arr[:-1].mean())
+    else:
+        oi_last = oi_mean_prev = math.nan
+    return _REGIMES[_regime_kernel(adx, ema9, ema21, ema50, basis, oi_last, oi_mean_prev)]
+
+
+def detect_regime(df: pd.DataFrame, metrics: dict) -> str:
+    """
+    Режим прямо по DataFrame: читаются только adx/ema_9/ema_21/ema_50 последнего бара
+    (без полного extract_features — ATR, объёмы и т.п. режиму не нужны).
+    """
+    if len(df) == 0:
         return "neutral"
+    oi_arr = metrics.get("oi_arr")
+    if oi_arr is None:
+        oi_arr = oi_to_array(metrics.get("oi") or [])
+    return _classify(
+        last_value(df, "adx"),
+        last_value(df, "ema_9"),
+        last_value(df, "ema_21"),
+        last_value(df, "ema_50"),
+        last_float(metrics.get("basis"), math.nan),
+        oi_arr,
+    )
+
 
-    last = df.iloc[-1]
-    adx = float(last.get("adx", np.nan))
-    ema9, ema21, ema50 = last.get("ema_9"), last.get("ema_21"), last.get("ema_50")
-    basis = metrics.get("basis")
-    oi_list = metrics.get("oi", [])
-
-    trend_stack = (ema9 is not None and ema21 is not None and ema50 is not None and ema9 > ema21 > ema50)
-    strong_adx = (not np.isnan(adx)) and adx > 25.0
-    basis_pos = (basis is not None and basis > 0)
-
-    oi_rising = False
-    try:
-        # для OI list может быть списком словарей/списков — нормализуем в float
-        vals = []
-        for x in oi_list[-10:]:
-            # V5 обычно отдает dict c ключами, но бывает список
-            if isinstance(x, dict):
-                v = x.get("openInterest")
-            else:
-                v = x[1] if len(x) > 1 else None
-            if v is not None:
-                vals.append(float(v))
-        if len(vals) >= 2 and vals[-1] > np.mean(vals[:-1]):
-            oi_rising = True
-    except Exception:
-        pass
-
-    if strong_adx and trend_stack and (basis_pos or oi_rising):
-        return "trend"
-
-    if (not np.isnan(adx)) and adx < 18.0 and (basis is None or abs(basis) < 1e-6):
-        return "mean-reversion"
-
-    return "neutral"
+warm_up(_regime_kernel, 1.0, 1.0, 1.0, 1.0, 0.0, 1.0, 1.0)
@@ -1,11 +1,40 @@
 import math
+import asyncio
 import logging
-from typing import Optional, Dict, Any, Callable
+import threading
+from decimal import Decimal
+from functools import lru_cache
+from typing import Optional, Dict, Any, Callable, Hashable, Mapping, Tuple
 
-from state import get_state, set_state
+import numpy as np
+from numba import njit
+
+from jit_utils import warm_up
+from state import HOT, state_slot, mark_state_dirty
 
 logger = logging.getLogger(__name__)
 
+# SL/TP везде округляются до 0.01 — столько знаков и отправляем
+PRICE_DECIMALS = 2
+# как round(qty, 6) в compute_position_size — пока шаг лота не известен
+DEFAULT_QTY_DECIMALS = 6
+# symbol -> число знаков qty по lotSizeFilter.qtyStep (см. set_qty_step)
+_QTY_DECIMALS: Dict[str, int] = {}
+
+# очередь заявок сопровождения (частичные TP, перенос SL): update_stops_and_partials
+# только ставит их в очередь, REST-вызовы выполняет воркер (см. start_order_worker)
+ORDER_QUEUE_MAXSIZE = 32
+_OrderJob = Tuple[
+    Callable[..., Any], Dict[str, Any],
+    Optional[Callable[[Any], None]], str, Optional[Callable[[Exception], None]],
+]
+_order_queue: Optional[asyncio.Queue] = None
+_order_loop: Optional[asyncio.AbstractEventLoop] = None
+_order_task: Optional[asyncio.Task] = None
+# key -> последняя версия заявки; в очереди лежит (key, None) — новая версия заменяет старую
+_coalesced: Dict[Hashable, _OrderJob] = {}
+_coalesced_lock = threading.Lock()
+
 
 def _round_step(value: float, step: float) -> float:
     if step <= 0:
@@ -13,6 +42,53 @@ def _round_step(value: float, step: float) -> float:
     return math.floor(value / step) * step
 
 
+@lru_cache(maxsize=None)
+def _step_decimals(step: float) -> int:
+    """Знаков после запятой у шага лота: 0.001 → 3, 0.5 → 1, 1 → 0."""
+    if step <= 0:
+        return DEFAULT_QTY_DECIMALS
+    return max(0, -Decimal(repr(step)).normalize().as_tuple().exponent)
+
+
+def set_qty_step(symbol: str, qty_step: float) -> None:
+    """Запомнить точность qty для символа (вызывать после чтения фильтров инструмента)."""
+    _QTY_DECIMALS[symbol] = _step_decimals(qty_step)
+
+
+def _fmt(x: float, decimals: int) -> str:
+    # фиксированная точность вместо str(float): без хвостов вида 0.009000000000000001
+    return f"{x:.{decimals}f}"
+
+
+def _side_sign(side: str) -> float:
+    # +1 для лонга, -1 для шорта: уровни считаются как price ± sign * k * atr
+    return 1.0 if side == "Buy" else -1.0
+
+
+def _effective_sl(i: int) -> Optional[float]:
+    """SL для решений на этом тике: ещё не подтверждённый pending_sl, иначе last_sl (NaN → None)."""
+    sl = float(HOT.pending_sl[i])
+    if math.isnan(sl):
+        sl = float(HOT.last_sl[i])
+    return None if math.isnan(sl) else sl
+
+
+@njit(cache=True)
+def _position_size_kernel(equity, price, risk_pct, min_qty, qty_step, min_order_value):
+    if price <= 0 or equity <= 0:
+        return 0.0
+    risk_capital = equity * risk_pct
+    raw_qty = risk_capital / (price * 0.01)
+    if min_qty > raw_qty:  # max(raw_qty, min_qty)
+        raw_qty = min_qty
+    if raw_qty * price < min_order_value:
+        raw_qty = min_order_value / price
+    qty = np.floor(raw_qty / qty_step) * qty_step if qty_step > 0 else raw_qty
+    if min_qty > qty:  # max(qty, min_qty)
+        qty = min_qty
+    return qty
+
+
 def compute_position_size(
     equity: float,
     price: float,
@@ -21,13 +97,10 @@ def compute_position_size(
     qty_step: float = 0.001,
     min_order_value: float = 5.0
 ) -> float:
-    if price <= 0 or equity <= 0:
-        return 0.0
-    risk_capital = equity * risk_pct
-    raw_qty = max(risk_capital / (price * 0.01), min_qty)
-    if raw_qty * price < min_order_value:
-        raw_qty = min_order_value / price
-    qty = max(_round_step(raw_qty, qty_step), min_qty)
+    qty = _position_size_kernel(
+        float(equity), float(price), float(risk_pct),
+        float(min_qty), float(qty_step), float(min_order_value),
+    )
     return round(qty, 6)
 
 
@@ -45,14 +118,14 @@ def place_market_order(
             symbol=symbol,
             side=side,
             orderType="Market",
-            qty=str(qty),
+            qty=_fmt(qty, _QTY_DECIMALS.get(symbol, DEFAULT_QTY_DECIMALS)),
             timeInForce="GoodTillCancel",
             reduceOnly=False,
         )
         if stop_loss is not None:
-            params["stopLoss"] = str(stop_loss)
+            params["stopLoss"] = _fmt(stop_loss, PRICE_DECIMALS)
         if take_profit is not None:
-            params["takeProfit"] = str(take_profit)
+            params["takeProfit"] = _fmt(take_profit, PRICE_DECIMALS)
 
         resp = session.place_order(**params)
         logger.info(f"✅ place_market_order: {resp}")
@@ -62,6 +135,70 @@ def place_market_order(
         return {"error": str(e)}
 
 
+def _execute(job: _OrderJob) -> None:
+    fn, params, on_done, what, on_error = job
+    try:
+        resp = fn(**params)
+        if on_done:
+            on_done(resp)
+    except Exception as e:
+        logger.warning(f"⚠️ {what} error: {e}")
+        if on_error:
+            on_error(e)
+
+
+async def _order_worker(executor) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        key, job = await _order_queue.get()
+        try:
+            if key is not None:
+                with _coalesced_lock:
+                    job = _coalesced.pop(key, None)
+            if job is not None:
+                await loop.run_in_executor(executor, _execute, job)
+        finally:
+            _order_queue.task_done()
+
+
+def start_order_worker(executor=None) -> asyncio.Task:
+    """Запустить воркер очереди заявок в текущем event loop (один раз при старте бота)."""
+    global _order_queue, _order_loop, _order_task
+    if _order_task is None or _order_task.done():
+        _order_loop = asyncio.get_running_loop()
+        _order_queue = asyncio.Queue(maxsize=ORDER_QUEUE_MAXSIZE)
+        _order_task = _order_loop.create_task(_order_worker(executor))
+    return _order_task
+
+
+def submit_order(
+    fn: Callable[..., Any],
+    params: Dict[str, Any],
+    on_done: Optional[Callable[[Any], None]] = None,
+    what: str = "order",
+    key: Optional[Hashable] = None,
+    on_error: Optional[Callable[[Exception], None]] = None,
+) -> None:
+    """
+    Поставить вызов fn(**params) в очередь (можно из любого потока).
+    on_done(resp) — после успешного вызова, on_error(exc) — после исключения; оба в потоке пула.
+    key — схлопывание: из заявок с одним ключом уйдёт только последняя.
+    Если воркер не запущен — выполняем сразу, синхронно.
+    """
+    job = (fn, params, on_done, what, on_error)
+    if _order_queue is None:
+        _execute(job)
+        return
+    if key is not None:
+        with _coalesced_lock:
+            queued = key in _coalesced
+            _coalesced[key] = job
+        if queued:
+            return
+        job = None  # воркер возьмёт актуальную версию из _coalesced
+    asyncio.run_coroutine_threadsafe(_order_queue.put((key, job)), _order_loop)
+
+
 def compute_initial_sl_tp(
     price: float,
     side: str,
@@ -72,14 +209,15 @@ def compute_initial_sl_tp(
     fb_sl_pct: float,
     fb_tp_pct: float
 ) -> Dict[str, float]:
+    s = _side_sign(side)
     if atr and atr > 0:
-        sl = price - atr_k_sl * atr if side == "Buy" else price + atr_k_sl * atr
-        tp1 = price + tp1_k * atr if side == "Buy" else price - tp1_k * atr
-        tp2 = price + tp2_k * atr if side == "Buy" else price - tp2_k * atr
+        sl = price - s * atr_k_sl * atr
+        tp1 = price + s * tp1_k * atr
+        tp2 = price + s * tp2_k * atr
     else:
-        sl = price * (1 - fb_sl_pct) if side == "Buy" else price * (1 + fb_sl_pct)
-        tp1 = price * (1 + fb_tp_pct) if side == "Buy" else price * (1 - fb_tp_pct)
-        tp2 = price * (1 + 2 * fb_tp_pct) if side == "Buy" else price * (1 - 2 * fb_tp_pct)
+        sl = price * (1 - s * fb_sl_pct)
+        tp1 = price * (1 + s * fb_tp_pct)
+        tp2 = price * (1 + s * 2 * fb_tp_pct)
     return {"sl": round(sl, 2), "tp1": round(tp1, 2), "tp2": round(tp2, 2)}
 
 
@@ -91,8 +229,8 @@ def should_add_position(
     mode: str,
     trail_k_atr: float
 ) -> bool:
-    st = get_state(symbol)
-    prev_sl = st.get("last_sl")
+    # учитываем и SL, который update_stops_and_partials уже отправил в очередь на этом тике
+    prev_sl = _effective_sl(state_slot(symbol))
     if prev_sl is None:
         return False
 
@@ -100,14 +238,14 @@ def should_add_position(
         atr_val = float(last_row.get("atr")) if last_row.get("atr") is not None else None
         if not atr_val or atr_val <= 0:
             return False
-        new_sl = (price - trail_k_atr * atr_val) if side == "Buy" else (price + trail_k_atr * atr_val)
+        new_sl = price - _side_sign(side) * trail_k_atr * atr_val
     else:
         if side == "Buy":
             new_sl = float(last_row.get("supertrend_lower", prev_sl))
         else:
             new_sl = float(last_row.get("supertrend_upper", prev_sl))
 
-    return (new_sl >= prev_sl) if side == "Buy" else (new_sl <= prev_sl)
+    return (new_sl - prev_sl) * _side_sign(side) >= 0
 
 
 def update_stops_and_partials(
@@ -118,7 +256,7 @@ def update_stops_and_partials(
     position_qty: float,
     price: float,
     last_row: Any,
-    cfg: Dict[str, Any],
+    cfg: Mapping[str, Any],
     lot_step: float,
     on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
 ) -> None:
@@ -126,17 +264,14 @@ def update_stops_and_partials(
     st_lower = float(last_row.get("supertrend_lower")) if last_row.get("supertrend_lower") is not None else None
     st_upper = float(last_row.get("supertrend_upper")) if last_row.get("supertrend_upper") is not None else None
 
-    state = get_state(symbol)
-    if "entry_price" not in state:
-        set_state(symbol, "entry_price", entry_price)
-        state = get_state(symbol)
+    # горячие ключи — прямо в колонках HOT по индексу символа; на диск — одна отложенная запись
+    i = state_slot(symbol)
+    dirty = False
+    if math.isnan(HOT.entry_price[i]):
+        HOT.entry_price[i] = entry_price
+        dirty = True
 
-    if "took_tp1" not in state:
-        set_state(symbol, "took_tp1", False); state = get_state(symbol)
-    if "took_tp2" not in state:
-        set_state(symbol, "took_tp2", False); state = get_state(symbol)
-
-    last_sl = state.get("last_sl")
+    last_sl = _effective_sl(i)
 
     tp1_k = float(cfg.get("atr_k_tp1", 1.0))
     tp2_k = float(cfg.get("atr_k_tp2", 2.0))
@@ -147,37 +282,54 @@ def update_stops_and_partials(
     ptp2 = float(cfg.get("partial_tp2_pct", 0.30))
 
     if not atr or atr <= 0:
+        if dirty:
+            mark_state_dirty()
         return
 
-    be_trigger = entry_price + be_k * atr if side == "Buy" else entry_price - be_k * atr
-    tp1_price = entry_price + tp1_k * atr if side == "Buy" else entry_price - tp1_k * atr
-    tp2_price = entry_price + tp2_k * atr if side == "Buy" else entry_price - tp2_k * atr
+    # s = +1 (Buy) / -1 (Sell): «в сторону прибыли» — это s * (x - y) > 0
+    s = _side_sign(side)
+    exit_side = "Sell" if s > 0 else "Buy"
+    be_trigger = entry_price + s * be_k * atr
+    tp1_price = entry_price + s * tp1_k * atr
+    tp2_price = entry_price + s * tp2_k * atr
 
     desired_sl = last_sl
-    if (side == "Buy" and price >= be_trigger) or (side == "Sell" and price <= be_trigger):
+    if (price - be_trigger) * s >= 0:
         breakeven = round(entry_price, 2)
-        desired_sl = max(desired_sl, breakeven) if side == "Buy" else (min(desired_sl, breakeven) if desired_sl is not None else breakeven)
+        if desired_sl is None or (breakeven - desired_sl) * s > 0:
+            desired_sl = breakeven
 
     if trailing == "atr":
-        trail_sl = (price - trail_k_atr * atr) if side == "Buy" else (price + trail_k_atr * atr)
+        trail_sl = price - s * trail_k_atr * atr
     else:
-        trail_sl = st_lower if side == "Buy" else st_upper
+        trail_sl = st_lower if s > 0 else st_upper
 
     if trail_sl is not None:
-        if desired_sl is None:
+        if desired_sl is None or (trail_sl - desired_sl) * s > 0:
             desired_sl = trail_sl
-        else:
-            desired_sl = max(desired_sl, trail_sl) if side == "Buy" else min(desired_sl, trail_sl)
 
     if desired_sl is not None:
         new_sl = round(desired_sl, 2)
-        if (last_sl is None) or (side == "Buy" and new_sl > last_sl) or (side == "Sell" and new_sl < last_sl):
-            try:
-                resp = session.set_trading_stop(category="linear", symbol=symbol, stopLoss=str(new_sl))
+        if (last_sl is None) or (new_sl - last_sl) * s > 0:
+            def _sl_done(resp: Any) -> None:
                 logger.info(f"🔧 SL update → {new_sl}: {resp}")
-                set_state(symbol, "last_sl", new_sl)
-            except Exception as e:
-                logger.warning(f"⚠️ set_trading_stop SL error: {e}")
+                HOT.last_sl[i] = new_sl
+                if HOT.pending_sl[i] == new_sl:
+                    HOT.pending_sl[i] = np.nan
+                mark_state_dirty()
+
+            def _sl_failed(_e: Exception) -> None:
+                # откат ожидания: на следующем тике SL снова сравнивается с last_sl и переотправляется
+                if HOT.pending_sl[i] == new_sl:
+                    HOT.pending_sl[i] = np.nan
+
+            # целевой SL виден сразу (should_add_position на этом же тике), last_sl — после ответа биржи
+            HOT.pending_sl[i] = new_sl
+            submit_order(
+                session.set_trading_stop,
+                dict(category="linear", symbol=symbol, stopLoss=_fmt(new_sl, PRICE_DECIMALS)),
+                _sl_done, "set_trading_stop SL", key=(symbol, "sl"), on_error=_sl_failed,
+            )
 
     def _reduce_only(qty: float) -> None:
         q = max(_round_step(qty, lot_step), 0.0)
@@ -186,30 +338,35 @@ def update_stops_and_partials(
         params = dict(
             category="linear",
             symbol=symbol,
-            side="Sell" if side == "Buy" else "Buy",
+            side=exit_side,
             orderType="Market",
-            qty=str(q),
+            qty=_fmt(q, _step_decimals(lot_step)),
             reduceOnly=True,
             timeInForce="GoodTillCancel",
         )
-        try:
-            r = session.place_order(**params)
+
+        def _partial_done(r: Any) -> None:
             logger.info(f"🎯 Partial TP filled qty={q}: {r}")
             if on_partial:
                 on_partial({
-                    "symbol": symbol, "side": "Sell" if side == "Buy" else "Buy",
+                    "symbol": symbol, "side": exit_side,
                     "qty": float(q), "event": "partial_take_profit"
                 })
-        except Exception as e:
-            logger.warning(f"⚠️ partial TP error: {e}")
 
-    took_tp1 = state.get("took_tp1", False)
-    took_tp2 = state.get("took_tp2", False)
+        submit_order(session.place_order, params, _partial_done, "partial TP")
 
-    if not took_tp1 and ((side == "Buy" and price >= tp1_price) or (side == "Sell" and price <= tp1_price)):
+    if not HOT.took_tp1[i] and (price - tp1_price) * s >= 0:
         _reduce_only(position_qty * ptp1)
-        set_state(symbol, "took_tp1", True)
+        HOT.took_tp1[i] = True
+        dirty = True
 
-    if not took_tp2 and ((side == "Buy" and price >= tp2_price) or (side == "Sell" and price <= tp2_price)):
+    if not HOT.took_tp2[i] and (price - tp2_price) * s >= 0:
         _reduce_only(position_qty * ptp2)
-        set_state(symbol, "took_tp2", True)
+        HOT.took_tp2[i] = True
+        dirty = True
+
+    if dirty:
+        mark_state_dirty()
+
+
+warm_up(_position_size_kernel, 1.0, 1.0, 0.01, 0.001, 0.001, 5.0)
@@ -1,9 +1,15 @@
 import math
-import os
-from typing import Dict, Tuple, Any, List
+from dataclasses import dataclass
+from typing import Dict, Tuple, Any, List, NamedTuple
 
+import numpy as np
 import pandas as pd
-import yaml
+from numba import njit
+
+from bybit_data import oi_to_array
+from config import CFG
+from frame_utils import last_float, last_value
+from jit_utils import warm_up
 
 
 # === Конфиг весов и порогов ===
@@ -54,187 +60,299 @@ _DEFAULT_CFG = {
 
 def _load_cfg() -> dict:
     try:
-        if os.path.exists("config.yaml"):
-            with open("config.yaml", "r") as f:
-                cfg = yaml.safe_load(f) or {}
-            weights = (cfg.get("weights") or {}).copy()
-            # вложенные секции можем частично переопределять
-            merged = _DEFAULT_CFG.copy()
-            for k in ["weights", "volume", "volatility", "ta", "bybit"]:
-                merged[k] = {**_DEFAULT_CFG[k], **(cfg.get(k, {}) or {})}
-            return merged
+        # вложенные секции можем частично переопределять
+        merged = _DEFAULT_CFG.copy()
+        for k in ["weights", "volume", "volatility", "ta", "bybit"]:
+            merged[k] = {**_DEFAULT_CFG[k], **(CFG.get(k, {}) or {})}
+        return merged
     except Exception:
-        pass
-    return _DEFAULT_CFG
+        return _DEFAULT_CFG
 
 
 _CFG = _load_cfg()
 
 
-# === Утилиты ===
-def _safe_last_float(x: Any, default: float = 0.0) -> float:
-    try:
-        if isinstance(x, list) and x:
-            x = x[-1]
-        if x is None:
-            return default
-        return float(x)
-    except Exception:
-        return default
+class _ScoreCfg(NamedTuple):
+    """
+    Плоский «замороженный» снимок _CFG: в горячем пути — атрибуты вместо вложенных dict.
+    NamedTuple (а не dataclass), чтобы его можно было передавать в Numba-ядро.
+    """
+    w_ta: float
+    w_bybit: float
+    w_volume: float
+    w_volatility: float
+
+    vol_surge_hi: float
+    vol_surge_lo: float
+    vol_score_hi: float
+    vol_score_lo: float
+
+    vola_atr_ma_window: int
+    vola_hot_ratio: float
+    vola_cold_ratio: float
+    vola_score_hot: float
+    vola_score_cold: float
+    vola_z_hi: float
+    vola_z_lo: float
+    vola_score_z_hi: float
+    vola_score_z_lo: float
+
+    ta_ema_stack_bonus: float
+    ta_adx_trend: float
+    ta_adx_score: float
+    ta_rsi_hot: float
+    ta_rsi_cold: float
+    ta_rsi_score: float
+    ta_vwap_alignment: float
+
+    by_funding_pos: float
+    by_funding_neg: float
+    by_basis_pos: float
+    by_basis_neg: float
+    by_lsr_pos: float
+    by_lsr_neg: float
+
+
+def _freeze_cfg(cfg: dict) -> _ScoreCfg:
+    w, vol, vola, ta, byb = cfg["weights"], cfg["volume"], cfg["volatility"], cfg["ta"], cfg["bybit"]
+    return _ScoreCfg(
+        w_ta=float(w["TA"]),
+        w_bybit=float(w["BybitData"]),
+        w_volume=float(w["Volume"]),
+        w_volatility=float(w["Volatility"]),
+        vol_surge_hi=float(vol["surge_hi"]),
+        vol_surge_lo=float(vol["surge_lo"]),
+        vol_score_hi=float(vol["score_hi"]),
+        vol_score_lo=float(vol["score_lo"]),
+        vola_atr_ma_window=int(vola["atr_ma_window"]),
+        vola_hot_ratio=float(vola["hot_ratio"]),
+        vola_cold_ratio=float(vola["cold_ratio"]),
+        vola_score_hot=float(vola["score_hot"]),
+        vola_score_cold=float(vola["score_cold"]),
+        vola_z_hi=float(vola["z_momentum_hi"]),
+        vola_z_lo=float(vola["z_momentum_lo"]),
+        vola_score_z_hi=float(vola["score_z_hi"]),
+        vola_score_z_lo=float(vola["score_z_lo"]),
+        ta_ema_stack_bonus=float(ta["ema_stack_bonus"]),
+        ta_adx_trend=float(ta["adx_trend"]),
+        ta_adx_score=float(ta["adx_score"]),
+        ta_rsi_hot=float(ta["rsi_hot"]),
+        ta_rsi_cold=float(ta["rsi_cold"]),
+        ta_rsi_score=float(ta["rsi_score"]),
+        ta_vwap_alignment=float(ta["vwap_alignment"]),
+        by_funding_pos=float(byb["funding_pos"]),
+        by_funding_neg=float(byb["funding_neg"]),
+        by_basis_pos=float(byb["basis_pos"]),
+        by_basis_neg=float(byb["basis_neg"]),
+        by_lsr_pos=float(byb["lsr_pos"]),
+        by_lsr_neg=float(byb["lsr_neg"]),
+    )
+
+
+_C = _freeze_cfg(_CFG)
 
 
-def _ema_stack_score(df: pd.DataFrame) -> float:
-    """Бонус/штраф за порядок EMA (тренд)."""
-    last = df.iloc[-1]
-    s = _CFG["ta"]["ema_stack_bonus"]
-    if last["ema_9"] > last["ema_21"] > last["ema_50"]:
-        return +s
-    if last["ema_9"] < last["ema_21"] < last["ema_50"]:
-        return -s
-    return 0.0
+# === Утилиты ===
+def _lsr_value(metrics: Dict[str, Any]) -> float:
+    """Последнее значение long/short ratio (NaN, если нет/не распарсилось)."""
+    # metrics["lsr"] ожидаем списком словарей или значений
+    lsr_list: List[Any] = metrics.get("lsr") or []
+    if lsr_list:
+        try:
+            last = lsr_list[-1]
+            if isinstance(last, dict):
+                # возможные ключи: "longShortRatio" или похожие
+                for k in ["longShortRatio", "ratio", "value"]:
+                    if k in last:
+                        return float(last[k])
+            else:
+                return float(last)
+        except Exception:
+            pass
+    return math.nan
 
 
-def _adx_score(df: pd.DataFrame) -> float:
-    last = df.iloc[-1]
-    if pd.isna(last.get("adx")):
-        return 0.0
-    if last["adx"] >= _CFG["ta"]["adx_trend"]:
-        return _CFG["ta"]["adx_score"]
-    return 0.0
+@njit(cache=True)
+def _pmax(a, b):
+    # семантика питоновского max(a, b) с NaN: a, если только b не строго больше
+    return b if b > a else a
 
 
-def _rsi_score(df: pd.DataFrame) -> float:
-    last = df.iloc[-1]
-    rsi = last.get("rsi")
-    if pd.isna(rsi):
-        return 0.0
-    if rsi >= _CFG["ta"]["rsi_hot"] or rsi <= _CFG["ta"]["rsi_cold"]:
-        return _CFG["ta"]["rsi_score"]  # лёгкий штраф за экстремумы
-    return 0.0
+@njit(cache=True)
+def _pmin(a, b):
+    return b if b < a else a
 
 
-def _vwap_alignment_score(df: pd.DataFrame) -> float:
-    last = df.iloc[-1]
-    # маленький бонус за согласие с VWAP
-    if pd.isna(last.get("vwap")):
-        return 0.0
-    return _CFG["ta"]["vwap_alignment"] if last["close"] >= last["vwap"] else -_CFG["ta"]["vwap_alignment"]
+@njit(cache=True)
+def _clip1(x):
+    return _pmax(_pmin(x, 1.0), -1.0)
 
 
-def _ta_subscore(df: pd.DataFrame) -> float:
+@njit(cache=True)
+def _score_kernel(
+    ema9, ema21, ema50, adx, rsi, vwap, close,
+    volume, vol_ma,
+    has_atr, atr, atr_ma, ema21_or_close,
+    funding, basis, lsr,
+    c,
+):
+    """
+    Все четыре подскора на скалярах (NaN = «нет значения»).
+    c — _ScoreCfg; пороги передаются аргументом, чтобы кэш Numba не «запекал» конфиг.
+    Возвращает (ta, volm, vola, byb), каждый в [-1; +1] (volm может быть NaN, как и раньше).
+    """
+    # --- TA ---
     s = 0.0
-    s += _ema_stack_score(df)
-    s += _adx_score(df)
-    s += _rsi_score(df)
-    s += _vwap_alignment_score(df)
+    # порядок EMA (тренд)
+    if ema9 > ema21 and ema21 > ema50:
+        s += c.ta_ema_stack_bonus
+    elif ema9 < ema21 and ema21 < ema50:
+        s -= c.ta_ema_stack_bonus
+    # ADX
+    if not np.isnan(adx) and adx >= c.ta_adx_trend:
+        s += c.ta_adx_score
+    # RSI: лёгкий штраф за экстремумы
+    if not np.isnan(rsi) and (rsi >= c.ta_rsi_hot or rsi <= c.ta_rsi_cold):
+        s += c.ta_rsi_score
+    # маленький бонус за согласие с VWAP
+    if not np.isnan(vwap):
+        s += c.ta_vwap_alignment if close >= vwap else -c.ta_vwap_alignment
     # нормировка (суммарно ожидаем диапазон около [-1; +1])
-    return max(min(s, 1.0), -1.0)
-
-
-def _volume_subscore(df: pd.DataFrame) -> float:
-    last = df.iloc[-1]
-    vol = float(last.get("volume") or 0)
-    vma = float(last.get("vol_ma_20") or 0)
-    if vma <= 0:
-        return 0.0
-    surge = vol / max(vma, 1e-9)
-    if surge >= _CFG["volume"]["surge_hi"]:
-        return _CFG["volume"]["score_hi"]
-    if surge <= _CFG["volume"]["surge_lo"]:
-        return _CFG["volume"]["score_lo"]
-    # интерполяция в нейтральной зоне
-    # между 0.7 и 1.5 плавно движемся к нулю
-    mid = 1.0
-    if surge >= mid:
-        frac = (surge - mid) / (max(_CFG["volume"]["surge_hi"] - mid, 1e-9))
-        return frac * _CFG["volume"]["score_hi"]
-    else:
-        frac = (mid - surge) / (max(mid - _CFG["volume"]["surge_lo"], 1e-9))
-        return -frac * abs(_CFG["volume"]["score_lo"])
-
-
-def _volatility_subscore(df: pd.DataFrame) -> float:
-    win = int(_CFG["volatility"]["atr_ma_window"])
-    if "atr" not in df.columns or df["atr"].isna().all():
-        return 0.0
-    atr = float(df.iloc[-1]["atr"])
-    if atr <= 0:
-        return 0.0
-    atr_ma = df["atr"].rolling(win, min_periods=1).mean().iloc[-1]
-    ratio = atr / max(atr_ma, 1e-9)
-
+    ta = _clip1(s)
+
+    # --- Volume ---
+    volm = 0.0
+    if not (vol_ma <= 0):
+        surge = volume / _pmax(vol_ma, 1e-9)
+        if surge >= c.vol_surge_hi:
+            volm = c.vol_score_hi
+        elif surge <= c.vol_surge_lo:
+            volm = c.vol_score_lo
+        # интерполяция в нейтральной зоне: между surge_lo и surge_hi плавно движемся к нулю
+        elif surge >= 1.0:
+            volm = (surge - 1.0) / _pmax(c.vol_surge_hi - 1.0, 1e-9) * c.vol_score_hi
+        else:
+            volm = -((1.0 - surge) / _pmax(1.0 - c.vol_surge_lo, 1e-9)) * abs(c.vol_score_lo)
+
+    # --- Volatility ---
+    vola = 0.0
+    if has_atr and not (atr <= 0):
+        s = 0.0
+        if not np.isnan(atr_ma):
+            ratio = atr / _pmax(atr_ma, 1e-9)
+            if ratio >= c.vola_hot_ratio:
+                s += c.vola_score_hot
+            elif ratio <= c.vola_cold_ratio:
+                s += c.vola_score_cold
+        # ATR-нормированный момент относительно EMA21
+        z = (close - ema21_or_close) / _pmax(atr, 1e-9)
+        if z >= c.vola_z_hi:
+            s += c.vola_score_z_hi
+        elif z <= c.vola_z_lo:
+            s += c.vola_score_z_lo
+        vola = _clip1(s)
+
+    # --- BybitData ---
     s = 0.0
-    if ratio >= _CFG["volatility"]["hot_ratio"]:
-        s += _CFG["volatility"]["score_hot"]
-    elif ratio <= _CFG["volatility"]["cold_ratio"]:
-        s += _CFG["volatility"]["score_cold"]
-
-    # ATR-нормированный момент относительно EMA21
-    ema21 = float(df.iloc[-1].get("ema_21") or df.iloc[-1]["close"])
-    z = (df.iloc[-1]["close"] - ema21) / max(atr, 1e-9)
-    if z >= _CFG["volatility"]["z_momentum_hi"]:
-        s += _CFG["volatility"]["score_z_hi"]
-    elif z <= _CFG["volatility"]["z_momentum_lo"]:
-        s += _CFG["volatility"]["score_z_lo"]
-
-    return max(min(s, 1.0), -1.0)
-
-
-def _bybit_data_subscore(metrics: Dict[str, Any]) -> float:
-    s = 0.0
-    # funding
-    funding = _safe_last_float(metrics.get("funding"))
     if funding > 0:
-        s += _CFG["bybit"]["funding_pos"]
+        s += c.by_funding_pos
     elif funding < 0:
-        s += _CFG["bybit"]["funding_neg"]
-
-    # basis
-    basis = _safe_last_float(metrics.get("basis"))
+        s += c.by_funding_neg
     if basis > 0:
-        s += _CFG["bybit"]["basis_pos"]
+        s += c.by_basis_pos
     elif basis < 0:
-        s += _CFG["bybit"]["basis_neg"]
+        s += c.by_basis_neg
+    if lsr > 1.0:
+        s += c.by_lsr_pos
+    elif lsr < 1.0:
+        s += c.by_lsr_neg
+    byb = _clip1(s)
 
-    # long/short ratio (lsr)
-    # metrics["lsr"] ожидаем списком словарей или значений
-    lsr_list: List[Any] = metrics.get("lsr") or []
-    lsr_val = None
-    if lsr_list:
-        try:
-            last = lsr_list[-1]
-            if isinstance(last, dict):
-                # возможные ключи: "longShortRatio" или похожие
-                for k in ["longShortRatio", "ratio", "value"]:
-                    if k in last:
-                        lsr_val = float(last[k]); break
-            else:
-                lsr_val = float(last)
-        except Exception:
-            lsr_val = None
-    if lsr_val is not None:
-        if lsr_val > 1.0:
-            s += _CFG["bybit"]["lsr_pos"]
-        elif lsr_val < 1.0:
-            s += _CFG["bybit"]["lsr_neg"]
+    return ta, volm, vola, byb
 
-    return max(min(s, 1.0), -1.0)
 
+def _atr_ma(atr_arr: np.ndarray, win: int) -> float:
+    """== rolling(win, min_periods=1).mean().iloc[-1], но без полного прохода по колонке."""
+    tail = atr_arr[-win:]
+    tail = tail[~np.isnan(tail)]
+    return float(tail.mean()) if tail.size else math.nan
 
-def score_signal(df: pd.DataFrame, metrics: Dict[str, Any]) -> Tuple[float, Dict[str, float]]:
+
+@dataclass(slots=True)
+class FeatureView:
+    """
+    Скаляры последнего бара + метрики Bybit, извлечённые один раз за цикл.
+    Общий вход для score_features() и regime.detect_regime_features(); NaN = «нет значения».
+    """
+    ema9: float
+    ema21: float
+    ema50: float
+    adx: float
+    rsi: float
+    vwap: float
+    close: float
+    volume: float
+    vol_ma: float
+    has_atr: bool
+    atr: float
+    atr_ma: float
+    ema21_or_close: float
+    funding: float
+    basis: float
+    lsr: float
+    oi_arr: np.ndarray
+
+
+def extract_features(df: pd.DataFrame, metrics: Dict[str, Any]) -> FeatureView:
+    """Снять последний бар (один df.iloc[-1]) и разобрать metrics в FeatureView."""
+    # последний элемент каждой нужной колонки напрямую из ndarray — без сборки строки df.iloc[-1]
+    cols = df.columns
+    close = float(df["close"].to_numpy()[-1])
+    ema21 = last_value(df, "ema_21")
+    ema21_or_close = (ema21 if "ema_21" in cols else 0.0) or close  # NaN «истинно» — как раньше
+    atr_arr = df["atr"].to_numpy(dtype=np.float64) if "atr" in cols else None
+    # достаточно последнего значения: при NaN в конце блок Volatility всё равно даёт 0
+    has_atr = atr_arr is not None and atr_arr.size > 0 and not math.isnan(atr_arr[-1])
+    oi_arr = metrics.get("oi_arr")
+    if oi_arr is None:
+        oi_arr = oi_to_array(metrics.get("oi") or [])
+    return FeatureView(
+        ema9=last_value(df, "ema_9"),
+        ema21=ema21,
+        ema50=last_value(df, "ema_50"),
+        adx=last_value(df, "adx"),
+        rsi=last_value(df, "rsi"),
+        vwap=last_value(df, "vwap"),
+        close=close,
+        volume=last_value(df, "volume", 0.0),
+        vol_ma=last_value(df, "vol_ma_20", 0.0),
+        has_atr=has_atr,
+        atr=float(atr_arr[-1]) if has_atr else math.nan,
+        atr_ma=_atr_ma(atr_arr, _C.vola_atr_ma_window) if has_atr else math.nan,
+        ema21_or_close=ema21_or_close,
+        funding=last_float(metrics.get("funding"), math.nan),
+        basis=last_float(metrics.get("basis"), math.nan),
+        lsr=_lsr_value(metrics),
+        oi_arr=oi_arr,
+    )
+
+
+def score_features(f: FeatureView) -> Tuple[float, Dict[str, float]]:
     """
     Возвращает:
       total_score: float
       breakdown: {"TA":..., "BybitData":..., "Volume":..., "Volatility":...}
     Каждая компонента ограничена [-1; +1], затем взвешивается весами из конфига.
     """
-    ta = _ta_subscore(df)
-    volm = _volume_subscore(df)
-    vola = _volatility_subscore(df)
-    byb = _bybit_data_subscore(metrics)
+    ta, volm, vola, byb = _score_kernel(
+        f.ema9, f.ema21, f.ema50, f.adx, f.rsi, f.vwap, f.close,
+        f.volume, f.vol_ma,
+        f.has_atr, f.atr, f.atr_ma, f.ema21_or_close,
+        f.funding, f.basis, f.lsr,
+        _C,
+    )
 
-    w = _CFG["weights"]
-    total = ta * w["TA"] + byb * w["BybitData"] + volm * w["Volume"] + vola * w["Volatility"]
+    total = ta * _C.w_ta + byb * _C.w_bybit + volm * _C.w_volume + vola * _C.w_volatility
 
     breakdown = {
         "TA": round(ta, 3),
@@ -243,3 +361,15 @@ def score_signal(df: pd.DataFrame, metrics: Dict[str, Any]) -> Tuple[float, Dict
         "Volatility": round(vola, 3),
     }
     return round(total, 2), breakdown
+
+
+def score_signal(df: pd.DataFrame, metrics: Dict[str, Any]) -> Tuple[float, Dict[str, float]]:
+    """Обёртка над score_features() для вызова с DataFrame."""
+    return score_features(extract_features(df, metrics))
+
+
+warm_up(
+    _score_kernel,
+    1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0,
+    True, 1.0, 1.0, 1.0, 0.0, 0.0, 1.0, _C,
+)
@@ -1,53 +1,223 @@
-import json
+import atexit
+import logging
 import os
 import threading
-from typing import Any, Dict
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
 
 STATE_FILE = "runtime_state.json"
+SAVE_DEBOUNCE_SEC = 0.2
+# отступ оставляем — файл читают глазами; numpy-скаляры (np.float64 из индикаторов) пишутся как числа
+_DUMP_OPTS = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
 _state_lock = threading.Lock()
+# «холодные» ключи: symbol -> dict, плюс глобальные "limits"
 _state_cache: Dict[str, Dict[str, Any]] = {}
 
+# «горячие» ключи сопровождения позиции читаются/пишутся каждый тик —
+# храним их колонками (structure-of-arrays) по индексу символа, см. state_slot()
+HOT_KEYS = ("entry_price", "last_sl", "took_tp1", "took_tp2")
+# pending_sl — SL, отправленный в очередь заявок, но ещё не подтверждённый биржей;
+# в файл не пишется (после рестарта заявки в очереди уже нет)
+_HOT_COLS = HOT_KEYS + ("pending_sl",)
+_HOT_CAPACITY = 4
+
+
+@dataclass(slots=True)
+class HotState:
+    """Колонки горячих ключей; NaN в entry_price/last_sl = «нет значения» (None в dict-API)."""
+    entry_price: np.ndarray
+    last_sl: np.ndarray
+    took_tp1: np.ndarray
+    took_tp2: np.ndarray
+    pending_sl: np.ndarray
+
+
+def _empty_hot(n: int) -> HotState:
+    return HotState(
+        entry_price=np.full(n, np.nan),
+        last_sl=np.full(n, np.nan),
+        took_tp1=np.zeros(n, dtype=np.bool_),
+        took_tp2=np.zeros(n, dtype=np.bool_),
+        pending_sl=np.full(n, np.nan),
+    )
+
+
+# массивы при росте заменяются новыми — обращаться через HOT.<колонка>[i], не кэшировать колонку
+HOT = _empty_hot(_HOT_CAPACITY)
+_sym_idx: Dict[str, int] = {}
+
+# фоновая запись: set_state/set_limit только помечают состояние «грязным»,
+# поток-писатель сбрасывает его на диск не чаще раза в SAVE_DEBOUNCE_SEC
+_dirty = threading.Event()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def _slot_locked(symbol: str) -> int:
+    i = _sym_idx.get(symbol)
+    if i is not None:
+        return i
+    i = len(_sym_idx)
+    n = len(HOT.last_sl)
+    if i >= n:
+        grown = _empty_hot(2 * n)
+        for col in _HOT_COLS:
+            getattr(grown, col)[:n] = getattr(HOT, col)
+            setattr(HOT, col, getattr(grown, col))
+    _sym_idx[symbol] = i
+    _state_cache.setdefault(symbol, {})
+    return i
+
+
+def state_slot(symbol: str) -> int:
+    """Индекс символа в колонках HOT (выделяется при первом обращении)."""
+    i = _sym_idx.get(symbol)
+    if i is None:
+        with _state_lock:
+            i = _slot_locked(symbol)
+    return i
+
+
+def _hot_get(i: int, key: str) -> Any:
+    v = getattr(HOT, key)[i]
+    if key.startswith("took_"):
+        return bool(v)
+    return None if np.isnan(v) else float(v)
+
+
+def _hot_set(i: int, key: str, value: Any) -> None:
+    if key.startswith("took_"):
+        getattr(HOT, key)[i] = bool(value)
+    else:
+        getattr(HOT, key)[i] = np.nan if value is None else float(value)
+
 
 def load_state() -> Dict[str, Dict[str, Any]]:
     """Загрузить состояние из файла в память (в начале работы бота)."""
     global _state_cache
+    raw: Dict[str, Dict[str, Any]] = {}
     if os.path.exists(STATE_FILE):
         try:
-            with open(STATE_FILE, "r") as f:
-                _state_cache = json.load(f)
+            with open(STATE_FILE, "rb") as f:
+                raw = orjson.loads(f.read())
         except Exception:
-            _state_cache = {}
-    else:
-        _state_cache = {}
+            raw = {}
+    with _state_lock:
+        _state_cache = raw
+        _sym_idx.clear()
+        fresh = _empty_hot(_HOT_CAPACITY)
+        for col in _HOT_COLS:
+            setattr(HOT, col, getattr(fresh, col))
+        # горячие ключи из файла переезжают в колонки
+        for symbol, st in list(raw.items()):
+            if symbol == "limits" or not isinstance(st, dict):
+                continue
+            i = _slot_locked(symbol)
+            for key in HOT_KEYS:
+                if key in st:
+                    _hot_set(i, key, st.pop(key))
     return _state_cache
 
 
+def _snapshot_locked() -> Dict[str, Dict[str, Any]]:
+    out = dict(_state_cache)
+    for symbol, i in _sym_idx.items():
+        st = dict(out.get(symbol) or {})
+        for key in HOT_KEYS:
+            st[key] = _hot_get(i, key)
+        out[symbol] = st
+    return out
+
+
 def save_state() -> None:
-    """Сохранить текущее состояние из памяти в файл."""
+    """Сохранить текущее состояние из памяти в файл (атомарно через tmp + os.replace)."""
     with _state_lock:
-        with open(STATE_FILE, "w") as f:
-            json.dump(_state_cache, f, indent=2)
+        data = orjson.dumps(_snapshot_locked(), option=_DUMP_OPTS)
+        tmp = STATE_FILE + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        try:
+            os.replace(tmp, STATE_FILE)
+        except OSError:
+            # файл смонтирован томом (docker-compose) — rename поверх него невозможен
+            with open(STATE_FILE, "wb") as f:
+                f.write(data)
+            os.remove(tmp)
+
+
+def _writer_loop() -> None:
+    while True:
+        _dirty.wait()
+        time.sleep(SAVE_DEBOUNCE_SEC)  # собираем серию изменений в одну запись
+        _dirty.clear()
+        try:
+            save_state()
+        except Exception as e:
+            logger.warning(f"⚠️ save_state error: {e}")
+
+
+def _mark_dirty() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="state-writer", daemon=True)
+            _writer.start()
+    _dirty.set()
+
+
+def flush_state() -> None:
+    """Немедленно записать отложенные изменения (при остановке бота)."""
+    if _writer is None:
+        return
+    _dirty.clear()
+    save_state()
+
+
+atexit.register(flush_state)
 
 
 def get_state(symbol: str) -> Dict[str, Any]:
-    """Получить state по символу (если нет — вернуть пустой словарь)."""
-    return _state_cache.get(symbol, {})
+    """Получить state по символу копией-словарём (если нет — пустой словарь)."""
+    i = _sym_idx.get(symbol)
+    if i is None:
+        return dict(_state_cache.get(symbol, {}))
+    st = dict(_state_cache.get(symbol, {}))
+    for key in HOT_KEYS:
+        st[key] = _hot_get(i, key)
+    return st
+
+
+def mark_state_dirty() -> None:
+    """Запланировать отложенную запись после прямых правок колонок HOT."""
+    _mark_dirty()
 
 
 def set_state(symbol: str, key: str, value: Any) -> None:
-    """Обновить ключ state по символу и сразу сохранить на диск."""
-    if symbol not in _state_cache:
-        _state_cache[symbol] = {}
-    _state_cache[symbol][key] = value
-    save_state()
+    """Обновить ключ state по символу; запись на диск — отложенно, в фоне."""
+    with _state_lock:
+        if key in HOT_KEYS:
+            i = _slot_locked(symbol)
+            _hot_set(i, key, value)
+            if key == "last_sl":
+                HOT.pending_sl[i] = np.nan  # явная установка/сброс SL отменяет ожидание
+        else:
+            _state_cache.setdefault(symbol, {})[key] = value
+    _mark_dirty()
 
 
 def set_limit(key: str, value: Any) -> None:
     """Обновить глобальные лимиты (cooldown, дневные лимиты и т.д.)."""
-    if "limits" not in _state_cache:
-        _state_cache["limits"] = {}
-    _state_cache["limits"][key] = value
-    save_state()
+    with _state_lock:
+        if "limits" not in _state_cache:
+            _state_cache["limits"] = {}
+        _state_cache["limits"][key] = value
+    _mark_dirty()
 
 
 def get_limit(key: str, default=None):
@@ -1,7 +1,6 @@
 import os
 import asyncio
-import yaml
-import pandas as pd
+from typing import Optional
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.client.default import DefaultBotProperties
@@ -10,13 +9,15 @@ from dotenv import load_dotenv
 from pybit.unified_trading import HTTP
 from bybit_data import (
     fetch_kline,
-    fetch_instrument_info,
-    fetch_wallet_equity,
-    fetch_available_balance,
+    get_instrument_info,
+    fetch_wallet_snapshot,
+    candles_to_df,
 )
+from config import CFG
+from io_pool import run_io
 from indicators import calculate_indicators
-from scoring import score_signal
-from regime import detect_regime
+from scoring import extract_features, score_features
+from regime import detect_regime_features
 
 load_dotenv()
 
@@ -28,8 +29,7 @@ if not TELEGRAM_TOKEN:
 bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
 dp = Dispatcher()
 
-with open("config.yaml", "r") as f:
-    _cfg = yaml.safe_load(f)
+_cfg = CFG
 
 SYMBOL = _cfg.get("symbol", "BTCUSDT")
 LOWER_TF = _cfg.get("lower_tf", "1")
@@ -50,6 +50,17 @@ def _make_session_live() -> HTTP:
     )
 
 
+# один клиент на процесс: requests.Session внутри держит keep-alive/TLS к Bybit
+_SESSION: Optional[HTTP] = None
+
+
+def get_session() -> HTTP:
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = _make_session_live()
+    return _SESSION
+
+
 async def send_telegram_message(text: str):
     if TELEGRAM_CHAT_ID:
         try:
@@ -96,8 +107,8 @@ async def status_cmd(m: types.Message):
 
 @dp.message(Command("price"))
 async def price_cmd(m: types.Message):
-    session = _make_session_live()
-    kl = fetch_kline(session, SYMBOL, LOWER_TF, 2)
+    session = get_session()
+    kl = await run_io(fetch_kline, session, SYMBOL, LOWER_TF, 2)
     if not kl:
         await m.answer("⚠️ Нет свежих свечей")
         return
@@ -113,14 +124,21 @@ async def balance_cmd(m: types.Message):
       • Available USDT (availableToTrade.walletBalance)
       • Краткую сводку по позиции по SYMBOL (если открыта)
     """
-    session = _make_session_live()
-    equity = fetch_wallet_equity(session)
-    available = fetch_available_balance(session, "USDT")
+    session = get_session()
+
+    # equity и available — из одного wallet-запроса; позиция — параллельно с ним
+    wallet, resp = await asyncio.gather(
+        run_io(fetch_wallet_snapshot, session, "USDT"),
+        run_io(session.get_positions, category="linear", symbol=SYMBOL),
+        return_exceptions=True,  # get_positions может бросить; исключение приходит значением
+    )
+    equity, available = (None, None) if isinstance(wallet, BaseException) else wallet
 
     # Сводка по позиции
     pos_txt = "позиции нет"
     try:
-        resp = session.get_positions(category="linear", symbol=SYMBOL)
+        if isinstance(resp, BaseException):
+            raise resp
         if resp.get("retCode") == 0:
             lst = (resp.get("result") or {}).get("list", []) or []
             for p in lst:
@@ -147,29 +165,27 @@ async def balance_cmd(m: types.Message):
 
 @dp.message(Command("why"))
 async def why_cmd(m: types.Message):
-    session = _make_session_live()
-    kl = fetch_kline(session, SYMBOL, LOWER_TF, 200)
+    session = get_session()
+    kl = await run_io(fetch_kline, session, SYMBOL, LOWER_TF, 200)
     if not kl:
         await m.answer("❌ Пока нет данных для анализа — нет свечей.")
         return
-    df = pd.DataFrame(kl, columns=["timestamp","open","high","low","close","volume","turnover"])
-    df["timestamp"] = pd.to_datetime(pd.to_numeric(df["timestamp"], errors="coerce"), unit="ms")
-    for c in ["open","high","low","close","volume","turnover"]:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-    df.sort_values("timestamp", inplace=True); df.reset_index(drop=True, inplace=True)
-    df = calculate_indicators(df)
+    df = candles_to_df(kl)
+    # расчёт индикаторов по 200 свечам — тоже вне event loop
+    df = await run_io(calculate_indicators, df)
 
     # Упрощённо: счёт по текущим данным
     metrics = {"oi": [], "funding": None, "basis": None, "lsr": []}
-    total, breakdown = score_signal(df, metrics)
-    regime = detect_regime(df, metrics)
+    # последний бар разбираем один раз — и для скоринга, и для режима, и для текста
+    features = extract_features(df, metrics)
+    total, breakdown = score_features(features)
+    regime = detect_regime_features(features)
 
-    last = df.iloc[-1]
     txt = (
         f"🤖 <b>Анализ сейчас (LIVE)</b>\n"
-        f"EMA9/21/50: {last['ema_9']:.1f} / {last['ema_21']:.1f} / {last['ema_50']:.1f}\n"
-        f"RSI: {last['rsi']:.1f} | ADX: {last['adx']:.1f}\n"
-        f"VWAP: {last['vwap']:.1f}\n\n"
+        f"EMA9/21/50: {features.ema9:.1f} / {features.ema21:.1f} / {features.ema50:.1f}\n"
+        f"RSI: {features.rsi:.1f} | ADX: {features.adx:.1f}\n"
+        f"VWAP: {features.vwap:.1f}\n\n"
         f"📊 TA: {breakdown['TA']:+.2f}\n"
         f"📈 BybitData: {breakdown['BybitData']:+.2f}\n"
         f"📊 Volume: {breakdown['Volume']:+.2f}\n"
@@ -186,17 +202,17 @@ async def testtrade_cmd(m: types.Message):
     LIVE круг: BUY на сумму TEST_TRADE_USDT → сразу SELL reduceOnly тем же qty.
     Важно: это реальная сделка.
     """
-    session = _make_session_live()
+    session = get_session()
 
     # 1) Цена
-    kl = fetch_kline(session, SYMBOL, "1", 2)
+    kl = await run_io(fetch_kline, session, SYMBOL, "1", 2)
     if not kl:
         await m.answer("❌ Нет цены для сделки.")
         return
     price = float(kl[-1][4])
 
     # 2) Фильтры инструмента (лот/минималки)
-    info = fetch_instrument_info(session, SYMBOL)
+    info = await run_io(get_instrument_info, session, SYMBOL)
     lot_step = float(info.get("lotSizeFilter", {}).get("qtyStep", 0.001)) if info else 0.001
     min_qty  = float(info.get("lotSizeFilter", {}).get("minOrderQty", 0.001)) if info else 0.001
     min_val  = float(info.get("lotSizeFilter", {}).get("minOrderAmt", 5.0)) if info else 5.0
@@ -214,7 +230,8 @@ async def testtrade_cmd(m: types.Message):
 
     # 4) BUY
     try:
-        buy_resp = session.place_order(
+        buy_resp = await run_io(
+            session.place_order,
             category="linear",
             symbol=SYMBOL,
             side="Buy",
@@ -233,7 +250,8 @@ async def testtrade_cmd(m: types.Message):
 
     # 5) Немедленный SELL reduceOnly на ту же qty (закроет позицию)
     try:
-        sell_resp = session.place_order(
+        sell_resp = await run_io(
+            session.place_order,
             category="linear",
             symbol=SYMBOL,
             side="Sell",
@@ -0,0 +1,66 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import analytics
+
+DAY = "2024-05-01"
+
+
+def _trade(k: int) -> dict:
+    return {
+        "ts": f"{DAY} 12:{k // 60 % 60:02d}:{k % 60:02d}", "symbol": "BTCUSDT", "side": "Buy",
+        "qty": 0.001, "price": 60000.0 + k, "event": "entry", "score": 2.0, "pnl": 1.0,
+    }
+
+
+def test_concurrent_saves_across_compaction(tmp_path):
+    root = tmp_path / "trades"
+    csv_path = tmp_path / "trades.csv"
+    n = 8 * 200  # 8 потоков × 200 сделок: партиция многократно проходит порог сжатия
+    stop = threading.Event()
+    read_errors = []
+
+    def _reader():
+        # чтение идёт параллельно с записью и сжатием — недописанных файлов видно быть не должно
+        while not stop.is_set():
+            try:
+                analytics.load_trades(root, date=DAY, columns=("score", "pnl"), csv_path=csv_path)
+            except Exception as e:
+                read_errors.append(e)
+
+    reader = threading.Thread(target=_reader)
+    reader.start()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            list(ex.map(lambda k: analytics.save_trade(_trade(k), root), range(n)))
+    finally:
+        stop.set()
+        reader.join()
+
+    assert read_errors == []
+    df = analytics.load_trades(root, date=DAY, csv_path=csv_path)
+    assert len(df) == n
+    assert sorted(df["price"]) == [60000.0 + k for k in range(n)]
+    assert len(analytics._part_files(root / f"date={DAY}")) < analytics.COMPACT_MAX_FILES
+
+
+def test_csv_tail_imported_once(tmp_path):
+    root = tmp_path / "trades"
+    csv_path = tmp_path / "trades.csv"
+    header = ",".join(analytics.TRADE_COLS) + "\n"
+    csv_path.write_text(
+        header
+        + "2024-04-30 23:59:00,BTCUSDT,Buy,0.001,60000,entry,59000,,1.9,trend,\n"
+        + f"{DAY} 00:10:00,BTCUSDT,Close,0.001,60100,exit,,,2.1,trend,0.1\n"
+        + f"{DAY} 00:20:00,BTCUSDT,Bu"  # строка ещё дописывается
+    )
+
+    assert len(analytics.load_trades(root, csv_path=csv_path)) == 2
+    assert len(analytics.load_trades(root, csv_path=csv_path)) == 2  # повторно не импортируется
+
+    with open(csv_path, "a") as f:
+        f.write("y,0.001,60200,entry,,,1.8,trend,\n")
+    day = analytics.load_trades(root, date=DAY, csv_path=csv_path)
+    assert list(day["ts"]) == [f"{DAY} 00:10:00", f"{DAY} 00:20:00"]
+    assert day["pnl"].isna().tolist() == [False, True]
+    assert day["sl"].isna().all()
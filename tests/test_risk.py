@@ -0,0 +1,81 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import risk
+import state
+
+SYMBOL = "BTCUSDT"
+CFG = {"atr_k_be": 0.5, "atr_k_tp1": 1.0, "atr_k_tp2": 2.0, "trailing": "supertrend"}
+# Buy от 1000, ATR 10: безубыток (1000) срабатывает с 1005, TP1 — только с 1010
+ROW = {"atr": 10.0, "supertrend_lower": 995.0, "supertrend_upper": 1020.0}
+
+
+class SlowSession:
+    """set_trading_stop отвечает с задержкой, как реальный REST-вызов."""
+
+    def __init__(self, fail: bool = False, delay: float = 0.3):
+        self.fail = fail
+        self.delay = delay
+        self.stops = []
+
+    def set_trading_stop(self, **params):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("timeout")
+        self.stops.append(params["stopLoss"])
+        return {"retCode": 0}
+
+    def place_order(self, **params):
+        return {"retCode": 0}
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(state, "STATE_FILE", str(tmp_path / "runtime_state.json"))
+    monkeypatch.setattr(state, "_mark_dirty", lambda: None)
+    monkeypatch.setattr(risk, "mark_state_dirty", lambda: None)
+    for name in ("_order_queue", "_order_loop", "_order_task"):
+        monkeypatch.setattr(risk, name, None)
+    state.load_state()
+    state.set_state(SYMBOL, "entry_price", 1000.0)
+    state.set_state(SYMBOL, "last_sl", 990.0)
+
+
+async def _tick(session):
+    """Один тик бота: сопровождение через пул, сразу за ним — проверка добора."""
+    executor = ThreadPoolExecutor(max_workers=2)
+    risk.start_order_worker(executor)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        executor, risk.update_stops_and_partials,
+        session, SYMBOL, "Buy", 1000.0, 0.01, 1006.0, ROW, CFG, 0.001,
+    )
+    add = risk.should_add_position(SYMBOL, "Buy", 1006.0, ROW, "supertrend", 1.0)
+    await risk._order_queue.join()
+    risk._order_task.cancel()
+    executor.shutdown()
+    return add
+
+
+def test_add_sees_queued_sl_on_same_tick():
+    session = SlowSession()
+    add = asyncio.run(_tick(session))
+
+    # SL уже переносится на безубыток 1000 — supertrend_lower 995 ниже, добора нет
+    assert add is False
+    assert session.stops == ["1000.00"]
+    assert state.get_state(SYMBOL)["last_sl"] == 1000.0
+    assert risk._effective_sl(state.state_slot(SYMBOL)) == 1000.0
+
+
+def test_failed_sl_update_rolls_back_pending():
+    session = SlowSession(fail=True)
+    asyncio.run(_tick(session))
+
+    # биржа не подтвердила перенос — решения снова опираются на прежний SL
+    assert state.get_state(SYMBOL)["last_sl"] == 990.0
+    assert risk._effective_sl(state.state_slot(SYMBOL)) == 990.0
+    assert risk.should_add_position(SYMBOL, "Buy", 1006.0, ROW, "supertrend", 1.0) is True